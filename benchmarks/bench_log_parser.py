@@ -0,0 +1,54 @@
+"""
+Compares parsing a synthetic Chat.log line by line with strptime and json.loads against exiles_api.logparse.
+Needs to be run from a directory containing a config.py since importing exiles_api connects to the databases.
+"""
+import os
+import json
+import argparse
+import tempfile
+from time import perf_counter
+from datetime import datetime, timedelta
+from exiles_api import logparse
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--lines', type=int, default=1000000, help="number of records written to the synthetic log")
+args = parser.parse_args()
+
+
+def reference_parse(filename):
+    """The parsing ChatLogs did before logparse existed."""
+    records = []
+    with open(filename, 'r', encoding='utf-8-sig') as f:
+        lines = f.readlines()
+    for line in lines[1:-1]:
+        data = json.loads(line)
+        data['datetime'] = datetime.strptime(data['datetime'], '%Y.%m.%d-%H.%M.%S:%f')
+        records.append(data)
+    return records
+
+
+with tempfile.TemporaryDirectory() as path:
+    filename = os.path.join(path, 'Chat.log')
+    start = datetime(2022, 11, 1)
+    with open(filename, 'w', encoding='utf-8-sig') as f:
+        f.write("Log file open, 11/01/22 00:00:00\n")
+        for i in range(args.lines):
+            date = (start + timedelta(milliseconds=1234 * i)).strftime('%Y.%m.%d-%H.%M.%S:%f')[:-3]
+            record = {'datetime': date, 'name': f"Player{i % 500}", 'channel': 'Global', 'type': 'Chat',
+                      'content': f"message number {i} äöü"}
+            f.write(json.dumps(record) + '\n')
+        f.write("Log file closed, 11/02/22 00:00:00\n")
+    size = os.path.getsize(filename) / 2**20
+    print(f"{args.lines} lines ({size:.1f} MiB), decoding JSON with {logparse.loads.__module__}")
+
+    t = perf_counter()
+    expected = reference_parse(filename)
+    reference = perf_counter() - t
+    t = perf_counter()
+    records = list(logparse.iter_file('Chat', filename))
+    fast = perf_counter() - t
+    if records != expected:
+        raise SystemExit("logparse and the reference parser disagree")
+
+print(f"strptime + json.loads: {reference:8.2f} s ({args.lines / reference:10.0f} lines/s)")
+print(f"logparse.iter_file:    {fast:8.2f} s ({args.lines / fast:10.0f} lines/s, {reference / fast:.1f}x)")
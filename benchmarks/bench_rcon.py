@@ -0,0 +1,98 @@
+"""
+Measures commands per second, latency percentiles and error rates of RCon commands sent by concurrent callers
+through TERPRCon.send_cmd, TERPRCon.safe_send_cmd or RConScheduler against the local stand-in server.
+Needs to be run from a directory containing a config.py since TERPRCon stores the time of the last command.
+"""
+import random
+import asyncio
+import argparse
+import threading
+from time import perf_counter
+from statistics import quantiles
+from collections import Counter
+from exiles_api import TERPRCon, RConScheduler
+from exiles_api.rcon_server import RConServer, DISCONNECT, slow
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--method', choices=('send_cmd', 'safe_send_cmd', 'scheduler'), default='safe_send_cmd')
+parser.add_argument('--commands', type=int, default=2000, help="total number of commands sent")
+parser.add_argument('--callers', type=int, default=8, help="number of concurrent callers")
+parser.add_argument('--connections', type=int, default=1, help="number of connections used by the scheduler")
+parser.add_argument('--delay', type=float, default=0.0, help="seconds the server waits before each reply")
+parser.add_argument('--empty', type=float, default=0.0, help="fraction of commands answered with an empty reply")
+parser.add_argument('--disconnect', type=float, default=0.0, help="fraction of commands answered by disconnecting")
+parser.add_argument('--timeout', type=float, default=5, help="seconds to wait for each reply")
+args = parser.parse_args()
+
+
+def reply(cmd):
+    rand = random.random()
+    if rand < args.disconnect:
+        return DISCONNECT
+    if rand < args.disconnect + args.empty:
+        return ''
+    name = cmd.split('"')[1]
+    return f"You gave {name} 1 Bronze"
+
+
+def run_server(server, started):
+    """Runs the server in its own thread and event loop so it doesn't compete with the clients for the loop."""
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    server.loop = loop
+    started.set()
+    loop.run_forever()
+
+
+async def main(port):
+    if args.method == 'scheduler':
+        client = RConScheduler('127.0.0.1', port, 'secret', args.connections, args.timeout, reconnect_delay=0)
+    else:
+        client = TERPRCon('127.0.0.1', port, 'secret')
+        await client.connect()
+    latencies, outcomes = [], Counter()
+    queue = list(range(args.commands))
+
+    async def caller():
+        while queue:
+            cmd = f'Currency add "Char{queue.pop()}" 1 bronze'
+            start = perf_counter()
+            try:
+                if args.method == 'send_cmd':
+                    result, success = (await client.send_cmd(cmd, args.timeout))[0], True
+                else:
+                    result, success = await client.safe_send_cmd(cmd, timeout=args.timeout)
+            except Exception as exc:
+                result, success = type(exc).__name__, False
+            latencies.append(perf_counter() - start)
+            outcomes['ok' if success else result[:60] or 'empty'] += 1
+            # reconnect a client dropped by the server, the scheduler does that on its own
+            if args.method != 'scheduler' and client._reader and client._reader.at_eof():
+                await client.close()
+                await client.connect()
+
+    start = perf_counter()
+    await asyncio.gather(*(caller() for _ in range(args.callers)))
+    duration = perf_counter() - start
+    if args.method == 'scheduler':
+        await client.stop()
+    else:
+        await client.close()
+    return duration, latencies, outcomes
+
+
+server = RConServer(password='secret')
+server.add_handler('Currency ', slow(args.delay, reply) if args.delay else reply)
+started = threading.Event()
+threading.Thread(target=run_server, args=(server, started), daemon=True).start()
+started.wait()
+duration, latencies, outcomes = asyncio.run(main(server.port))
+asyncio.run_coroutine_threadsafe(server.stop(), server.loop).result()
+server.loop.call_soon_threadsafe(server.loop.stop)
+
+percentiles = quantiles(latencies, n=100)
+print(f"{args.method}, {args.callers} callers, {args.commands} commands in {duration:.2f} s")
+print(f"{args.commands / duration:10.0f} commands/s")
+print(f"p50 {percentiles[49] * 1000:8.2f} ms, p99 {percentiles[98] * 1000:8.2f} ms")
+for outcome, num in outcomes.most_common():
+    print(f"{num / args.commands:8.2%} {outcome}")
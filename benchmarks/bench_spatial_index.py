@@ -0,0 +1,48 @@
+"""
+Compares selecting the buildings within random location boxes with and without the SpatialIndex.
+Needs to be run from a directory containing the config.py pointing to the game.db to read the positions from.
+The spatial index is created next to the game.db if it doesn't exist yet.
+"""
+import argparse
+import random
+from time import perf_counter
+from sqlalchemy import create_engine
+from exiles_api import ECHO, GAME_DB, SAVED_DIR_PATH, Buildings, SpatialIndex
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--boxes', type=int, default=50, help="number of random location boxes to query")
+parser.add_argument('--size', type=float, default=20000, help="edge length of the location boxes")
+args = parser.parse_args()
+
+index = SpatialIndex(GAME_DB)
+start = perf_counter()
+num = index.update()
+print(f"Updated spatial index with {num} changed positions in {perf_counter() - start:.2f} s")
+
+engine = create_engine("sqlite:///" + SAVED_DIR_PATH + '/' + GAME_DB, echo=ECHO)
+with engine.connect() as conn:
+    conn.execute(f"ATTACH DATABASE '{index.path}' AS 'spatial'")
+    x_min, x_max, y_min, y_max = conn.execute(
+        "SELECT MIN(x), MAX(x), MIN(y), MAX(y) FROM actor_position, buildings WHERE id = object_id"
+    ).one()
+    boxes = []
+    for _ in range(args.boxes):
+        x, y = random.uniform(x_min, x_max), random.uniform(y_min, y_max)
+        boxes.append(((x, x + args.size), (y, y + args.size)))
+
+    results = {}
+    for spatial in (None, 'spatial'):
+        start = perf_counter()
+        results[spatial] = [
+            sorted(id for id, in conn.execute(Buildings._get_objects_query(None, loc, spatial=spatial)).all())
+            for loc in boxes
+        ]
+        results[spatial, 'time'] = perf_counter() - start
+engine.dispose()
+
+if results[None] != results['spatial']:
+    raise SystemExit("Queries with and without spatial index disagree")
+scan, indexed = results[None, 'time'], results['spatial', 'time']
+print(f"{args.boxes} boxes, {sum(map(len, results[None]))} buildings found")
+print(f"without index: {scan * 1000 / args.boxes:8.2f} ms per box")
+print(f"with index:    {indexed * 1000 / args.boxes:8.2f} ms per box ({scan / indexed:.1f}x)")
@@ -0,0 +1,29 @@
+"""
+Compares decoding Pippi wallets row by row through Properties.money with Properties.decode_wallets.
+Needs to be run from a directory containing the config.py pointing to the game.db to read the wallets from.
+"""
+import argparse
+from timeit import timeit
+from exiles_api import session, np, Properties
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--repeat', type=int, default=1, help="multiply the wallets found in the db by this factor")
+parser.add_argument('--number', type=int, default=5, help="number of timed runs per method")
+args = parser.parse_args()
+
+p_name = "Pippi_WalletComponent_C.walletAmount"
+wallets = session.query(Properties).filter_by(name=p_name).all() * args.repeat
+rows = [(p.object_id, p.value) for p in wallets]
+values = [p.value for p in wallets]
+print(f"{len(rows)} wallets, decoding with {'NumPy' if np is not None else 'struct.iter_unpack'}")
+
+object_ids, amounts = Properties.decode_wallets(rows)
+if amounts.tolist() != [p.money for p in wallets]:
+    raise SystemExit("decode_wallets and Properties.money disagree")
+
+per_row = timeit(lambda: [p.money for p in wallets], number=args.number) / args.number
+bulk = timeit(lambda: Properties.decode_wallets(rows), number=args.number) / args.number
+encode = timeit(lambda: Properties.encode_wallets(values, amounts), number=args.number) / args.number
+print(f"Properties.money:        {per_row * 1000:10.2f} ms")
+print(f"Properties.decode_wallets: {bulk * 1000:8.2f} ms ({per_row / bulk:.1f}x)")
+print(f"Properties.encode_wallets: {encode * 1000:8.2f} ms")
@@ -1,21 +1,38 @@
 import os
 import json
+import asyncio
 import warnings
 from operator import itemgetter
-from aiomcrcon import Client
+import itertools
+from itertools import product
+from heapq import merge
+from bisect import bisect_left
+from collections import Counter
+import gzip
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from aiomcrcon import Client, ClientNotConnectedError
 from psutil import process_iter
 from statistics import median, mean
 from math import floor, ceil, sqrt
-from struct import pack, unpack
-from time import sleep
+from array import array
+from struct import pack, unpack, unpack_from, pack_into, iter_unpack
+from time import sleep, monotonic, perf_counter
 from datetime import datetime, timedelta, time
 from sqlalchemy.orm import sessionmaker, Session, relationship, backref
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine, literal, desc, MetaData, exc as sa_exc
-from sqlalchemy import Column, ForeignKey, or_, func, distinct, Text, Integer, String, DateTime, Boolean
+from sqlalchemy import create_engine, literal, desc, exists, bindparam, event, MetaData, exc as sa_exc
+from sqlalchemy import Column, ForeignKey, or_, func, Text, Integer, String, DateTime, Boolean
+from .logparse import parse_date, parse_line, iter_file, parse_file, open_log, zstandard, COMPRESSED_EXTENSIONS
 from config import GAME_DB_URI, ECHO, USERS_DB_URI, SAVED_DIR_PATH, EXE_DIR_PATH, GAME_DB, BACKUP_DB
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 GameBase = declarative_base()
 UsersBase = declarative_base()
 
@@ -41,42 +58,215 @@ trc = None
 RANKS = ('Recruit', 'Member', 'Officer', 'Guildmaster')
 ITER = (list, tuple, set)
 NUMBER = (int, float)
+# gold, silver and bronze of a Pippi wallet are stored as 4 byte integers at fixed offsets of the properties value
+WALLET_OFFSETS = (73, 148, 223)
+WALLET_SIZE = 227
+WALLET_FORMAT = '<73xi71xi71xi'
+# maximum number of ids used as bound parameters of a single query
+CHUNK_SIZE = 500
 
 
 def is_running(process_name="ConanSandboxServer", strict=False):
     """Check if there is any running process that contains the given name process_name."""
-    # Iterate over the all the running process
-    for proc in process_iter():
-        try:
-            # Check if process name partially or completely matches the given name string.
-            if (not strict and process_name.lower() in proc.name().lower()) or (strict and process_name == proc.name()):
-                # Check if the process is running the correct directory
-                if os.path.realpath(proc.exe()).startswith(os.path.realpath(EXE_DIR_PATH)):
-                    return True
-        except Exception:
-            pass
-    return False
+    if (process_name, strict) == (server_state.process_name, server_state.strict):
+        return server_state.is_running()
+    # other processes get a ServerState of their own, so they're cached as well
+    if (process_name, strict) not in _server_states:
+        _server_states[(process_name, strict)] = ServerState(process_name, strict)
+    return _server_states[(process_name, strict)].is_running()
 
 
 def allows_login():
     """
     Returns True if logfile indicates that logging in should be possible.
     """
+    return server_state.allows_login()
 
-    if not is_running():
-        return False
 
-    try:
-        path = os.path.join(SAVED_DIR_PATH, "Logs", "ConanSandbox.log")
-        with open(path) as logfile:
-            contents = logfile.read()
-            startup_msg = "LogLoad: (Engine Initialization)"
-            shutdown_msg = "LogExit: GameNetDriver IpNetDriver_0 shut down"
-            if startup_msg in contents and shutdown_msg not in contents:
-                return True
+class ServerState:
+    """
+    Cached version of is_running and allows_login for frequent checks.
+    Once found, the server process is kept and only checked for still running instead of searching all processes.
+    If it isn't running, all processes are searched again at most every ttl seconds. The ConanSandbox.log is read
+    incrementally, i.e. only the bytes appended since the last check at most every ttl seconds are searched for the
+    startup and shutdown messages and reading starts over when the log has been replaced.
+    """
+    startup_msg = b"LogLoad: (Engine Initialization)"
+    shutdown_msg = b"LogExit: GameNetDriver IpNetDriver_0 shut down"
+
+    def __init__(self, process_name="ConanSandboxServer", strict=False, ttl=5, log_path=None):
+        self.process_name = process_name
+        self.strict = strict
+        self.ttl = ttl
+        self.log_path = log_path or os.path.join(SAVED_DIR_PATH, "Logs", "ConanSandbox.log")
+        self._process = None
+        self._searched = None
+        self._scanned = None
+        self._log_identity = None
+        self._offset = 0
+        self._started = False
+        self._shut_down = False
+
+    def _find_process(self):
+        for proc in process_iter():
+            try:
+                name = proc.name()
+                if (not self.strict and self.process_name.lower() in name.lower()) or \
+                   (self.strict and self.process_name == name):
+                    if os.path.realpath(proc.exe()).startswith(os.path.realpath(EXE_DIR_PATH)):
+                        return proc
+            except Exception:
+                pass
+        return None
+
+    def is_running(self):
+        """Check if the server process is running."""
+        # is_running also compares the creation time, so a reused pid isn't mistaken for the server
+        if self._process and self._process.is_running():
+            return True
+        self._process = None
+        now = monotonic()
+        if self._searched is None or now - self._searched >= self.ttl:
+            self._searched = now
+            self._process = self._find_process()
+            # a new server process writes a new log, so don't rely on what was read before
+            if self._process:
+                self._scanned = None
+        return self._process is not None
+
+    def _scan_log(self):
+        stat = os.stat(self.log_path)
+        identity = (stat.st_dev, stat.st_ino)
+        if identity != self._log_identity or stat.st_size < self._offset:
+            self._log_identity = identity
+            self._offset, self._started, self._shut_down = 0, False, False
+        with open(self.log_path, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        # the whole chunk is searched but an incomplete last line will be searched again next time
+        self._started = self._started or self.startup_msg in chunk
+        self._shut_down = self._shut_down or self.shutdown_msg in chunk
+        self._offset += chunk.rfind(b'\n') + 1
+
+    def allows_login(self):
+        """Returns True if logfile indicates that logging in should be possible."""
+        if not self.is_running():
             return False
-    except Exception:
-        return False
+        now = monotonic()
+        if self._scanned is None or now - self._scanned >= self.ttl:
+            try:
+                self._scan_log()
+                self._scanned = now
+            except Exception:
+                self._log_identity = None
+                return False
+        return self._started and not self._shut_down
+
+
+server_state = ServerState()
+_server_states = dict()
+
+
+class PresenceCache:
+    """
+    Set of the names and ids of all online characters so repeated online checks don't need to query the game.db.
+    refresh() runs ListPlayers through the given TERPRCon connection if it's connected and reads the online column
+    of all accounts at once otherwise. is_online() answers from memory and refreshes from the accounts first if the
+    last refresh is older than max_age seconds. Use start() to refresh every interval seconds in the background.
+    Assign an instance to the module level presence to make Properties.set_money use it.
+    """
+    def __init__(self, trc=None, max_age=30):
+        self.trc = trc
+        self.max_age = max_age
+        self.names = set()
+        self.ids = set()
+        self.updated = None
+        self._task = None
+
+    @staticmethod
+    def parse_list_players(reply):
+        """
+        Returns the character names listed in the reply to ListPlayers or None if the reply doesn't start with its
+        header, e.g. if it's the reply to another command or an error message.
+        """
+        lines = [line for line in reply.splitlines() if line.strip()]
+        header = [column.strip() for column in lines[0].split('|')] if lines else []
+        if header[:2] != ['Idx', 'Char name']:
+            return None
+        names = []
+        # the character name is in the second column
+        for line in lines[1:]:
+            columns = line.split('|')
+            if len(columns) < 2:
+                continue
+            names.append(columns[1].strip())
+        return names
+
+    def _update(self, rows):
+        self.ids = {id for id, _ in rows}
+        self.names = {name for _, name in rows}
+        self.updated = monotonic()
+
+    def refresh_from_db(self):
+        C = Characters
+        rows = session.query(C.id, C.name).filter(C.player_id == Account.player_id, Account.online == 1).all()
+        self._update(rows)
+
+    async def refresh(self):
+        if not self.trc or not self.trc.is_connected:
+            self.refresh_from_db()
+            return
+        reply, success = await self.trc.safe_send_cmd('ListPlayers', noblank=False)
+        names = self.parse_list_players(reply) if success else None
+        # an unexpected reply would mark everyone as offline
+        if names is None:
+            self.refresh_from_db()
+            return
+        # names aren't unique but only the active character of an account can be online
+        C = Characters
+        rows = []
+        for idx in range(0, len(names), CHUNK_SIZE):
+            chunk = names[idx:idx + CHUNK_SIZE]
+            rows += session.query(C.id, C.name).filter(C.name.in_(chunk), C.player_id == Account.player_id).all()
+        self._update(rows)
+
+    def is_stale(self, max_age=None):
+        max_age = self.max_age if max_age is None else max_age
+        return self.updated is None or monotonic() - self.updated > max_age
+
+    def is_online(self, char_id, max_age=None):
+        if self.is_stale(max_age):
+            self.refresh_from_db()
+        return char_id in self.ids
+
+    def is_name_online(self, name, max_age=None):
+        if self.is_stale(max_age):
+            self.refresh_from_db()
+        return name in self.names
+
+    async def _run(self, interval):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"Failed to refresh the online characters.\n{str(exc)}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval=10):
+        if not self._task or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(interval))
+        return self._task
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+# if set to a PresenceCache it's used instead of reading the online status of each account from the game.db
+presence = None
 
 
 def get_raw_sql(query):
@@ -187,15 +377,169 @@ def iter2str(value):
 
 
 # RCon
+class RConMetrics:
+    """
+    Counts the RCon commands sent by TERPRCon per verb (the first word of the command) and outcome, i.e. ok, empty,
+    timeout, busy (another command was still waiting for its reply), not_connected or error, and records their
+    latency in a histogram per verb. Assign an instance to TERPRCon.metrics or the metrics attribute of a single
+    connection to enable it. If path is given the metrics are written to it in the Prometheus text format at most
+    every interval seconds, e.g. for the textfile collector of the node exporter.
+    """
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, path=None, interval=15):
+        self.path = path
+        self.interval = interval
+        self.counts = Counter()
+        self.histograms = dict()
+        self.in_flight = 0
+        self._written = None
+
+    def observe(self, verb, seconds, outcome):
+        self.counts[(verb, outcome)] += 1
+        histogram = self.histograms.get(verb)
+        if not histogram:
+            # count per bucket with the last one for everything above the largest bucket, followed by the sum
+            histogram = self.histograms[verb] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+        if self.path and (self._written is None or monotonic() - self._written >= self.interval):
+            self.write()
+
+    def snapshot(self):
+        """Returns a dict with the counts by outcome and the number, total time and quantiles of commands by verb."""
+        outcomes = Counter()
+        for (_, outcome), num in self.counts.items():
+            outcomes[outcome] += num
+        verbs = dict()
+        for verb, histogram in self.histograms.items():
+            num = sum(histogram[:-1])
+            verbs[verb] = {
+                'count': num,
+                'sum': histogram[-1],
+                'outcomes': {outcome: n for (v, outcome), n in self.counts.items() if v == verb},
+                'p50': self._quantile(histogram, num, 0.5),
+                'p99': self._quantile(histogram, num, 0.99),
+            }
+        return {'in_flight': self.in_flight, 'outcomes': dict(outcomes), 'verbs': verbs}
+
+    def _quantile(self, histogram, num, q):
+        """Returns the upper bound of the bucket the quantile q falls into or None if it's above the largest."""
+        total = 0
+        for idx, bucket in enumerate(self.buckets):
+            total += histogram[idx]
+            if total >= q * num:
+                return bucket
+        return None
+
+    @staticmethod
+    def _escape(value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP exiles_rcon_commands_total RCon commands sent by verb and outcome.",
+            "# TYPE exiles_rcon_commands_total counter",
+        ]
+        for (verb, outcome), num in sorted(self.counts.items()):
+            lines.append(f'exiles_rcon_commands_total{{verb="{self._escape(verb)}",outcome="{outcome}"}} {num}')
+        lines += [
+            "# HELP exiles_rcon_command_seconds Time until the reply of RCon commands was received.",
+            "# TYPE exiles_rcon_command_seconds histogram",
+        ]
+        for verb, histogram in sorted(self.histograms.items()):
+            label = f'verb="{self._escape(verb)}"'
+            total = 0
+            for bucket, num in zip(self.buckets + ('+Inf',), histogram):
+                total += num
+                lines.append(f'exiles_rcon_command_seconds_bucket{{{label},le="{bucket}"}} {total}')
+            lines.append(f'exiles_rcon_command_seconds_sum{{{label}}} {histogram[-1]}')
+            lines.append(f'exiles_rcon_command_seconds_count{{{label}}} {total}')
+        lines += [
+            "# HELP exiles_rcon_in_flight RCon commands currently waiting for their reply.",
+            "# TYPE exiles_rcon_in_flight gauge",
+            f"exiles_rcon_in_flight {self.in_flight}",
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path=None):
+        """Writes the metrics to path or self.path replacing the file at once so it's never read half written."""
+        path = path or self.path
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(path + '.tmp', path)
+        self._written = monotonic()
+
+
 class TERPRCon(Client):
+    # instance of RConMetrics used by all connections that don't have their own, None disables the metrics
+    metrics = None
+
+    def __init__(self, host: str, port: int, password: str, flush_interval=10) -> None:
+        super().__init__(host, port, password)
+        # LAST_CMD is written to GlobalVars at most every flush_interval seconds and when the connection is closed
+        self.flush_interval = flush_interval
+        self._last_cmd = None
+        self._dirty = False
+        self._flushed = None
+        self._flush_handle = None
+
     async def send_cmd(self, cmd: str, timeout=60) -> tuple:
         """ Like the original send_cmd in Client but stores utcnow in GlovaVars """
-        GlobalVars.set_value("LAST_CMD", datetime.timestamp(datetime.utcnow()))
-        return await super().send_cmd(cmd, timeout)
+        self._last_cmd = datetime.timestamp(datetime.utcnow())
+        self._dirty = True
+        now = monotonic()
+        if self._flushed is None or now - self._flushed >= self.flush_interval:
+            self.flush()
+        # make sure the time of the last command of a burst gets written as well
+        elif not self._flush_handle:
+            delay = self.flush_interval - (now - self._flushed)
+            self._flush_handle = asyncio.get_running_loop().call_later(delay, self.flush)
+        metrics = self.metrics
+        if metrics is None:
+            return await super().send_cmd(cmd, timeout)
+
+        verb, outcome = cmd.split(' ', 1)[0], 'error'
+        metrics.in_flight += 1
+        start = perf_counter()
+        try:
+            response = await super().send_cmd(cmd, timeout)
+            outcome = 'ok' if response[0] != '' else 'empty'
+            return response
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            raise
+        except ClientNotConnectedError:
+            outcome = 'not_connected'
+            raise
+        except RuntimeError as err:
+            if str(err).startswith('read() called while another coroutine'):
+                outcome = 'busy'
+            raise
+        finally:
+            metrics.in_flight -= 1
+            metrics.observe(verb, perf_counter() - start, outcome)
+
+    def flush(self):
+        """Writes the time of the last command to GlobalVars if it hasn't been written yet."""
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._dirty:
+            GlobalVars.set_value("LAST_CMD", self._last_cmd)
+            self._dirty = False
+            self._flushed = monotonic()
+
+    async def close(self):
+        self.flush()
+        await super().close()
 
     async def safe_send_cmd(self, cmd: str, timeout=60, noblank=True) -> tuple:
         """ Like self.send_cmd but wrapped in a try/error with a default message """
         if not self._ready:
+            if self.metrics is not None:
+                self.metrics.observe(cmd.split(' ', 1)[0], 0.0, 'not_connected')
             return 'No RCon connection available, please try again later', False
         try:
             response = await self.send_cmd(cmd, timeout)
@@ -215,21 +559,322 @@ class TERPRCon(Client):
 
     @property
     def last_cmd(self):
+        # only read GlobalVars if no command has been sent through this connection yet
+        if self._last_cmd is not None:
+            return str(self._last_cmd)
         return GlobalVars.get_value("LAST_CMD")
 
     @last_cmd.setter
     def last_cmd(self, value):
-        GlobalVars.set_value("LAST_CMD", value)
+        self._last_cmd = value
+        self._dirty = True
+        self.flush()
 
     @property
     def is_connected(self):
         return self._ready
 
 
+class RConScheduler:
+    """
+    Queues RCon commands and runs them one at a time per connection instead of refusing commands while another
+    one is still waiting for its reply. Commands with a lower priority value run first, commands with the same
+    priority in the order they were queued. With more than one connection (if the server allows it) the commands
+    are run by a pool of TERPRCon clients in parallel. A connection that failed or timed out is closed and opened
+    again for the next command since a late reply would otherwise be read as the reply to that command.
+    Failed commands aren't retried as commands like Currency add aren't idempotent.
+    """
+    def __init__(self, host, port, password, connections=1, timeout=60, reconnect_delay=1):
+        self.clients = [TERPRCon(host, port, password) for _ in range(connections)]
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self._queue = None
+        self._counter = itertools.count()
+        self._workers = []
+
+    @property
+    def pending(self):
+        """Number of commands waiting to be run."""
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def is_connected(self):
+        return any(client.is_connected for client in self.clients)
+
+    async def start(self):
+        """
+        Starts one worker per connection and restarts workers that have died. Connections are opened by the workers
+        when needed.
+        """
+        if not self._workers:
+            self._queue = asyncio.PriorityQueue()
+            self._workers = [None] * len(self.clients)
+        loop = asyncio.get_running_loop()
+        for idx, client in enumerate(self.clients):
+            worker = self._workers[idx]
+            if worker and not worker.done():
+                continue
+            if worker and not worker.cancelled() and worker.exception():
+                print(f"RCon worker died and is restarted.\n{str(worker.exception())}")
+            self._workers[idx] = loop.create_task(self._work(client))
+
+    async def stop(self):
+        """Stops the workers, cancels all commands still waiting and closes the connections."""
+        workers = [worker for worker in self._workers if worker]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._workers = []
+        while self._queue and not self._queue.empty():
+            self._queue.get_nowait()[-1].cancel()
+        for client in self.clients:
+            await self._close(client)
+
+    @staticmethod
+    async def _close(client):
+        try:
+            await client.close()
+        except Exception:
+            pass
+        client._ready = False
+
+    async def _work(self, client):
+        while True:
+            _, _, cmd, timeout, future = await self._queue.get()
+            # the caller might have stopped waiting already
+            if future.done():
+                continue
+            try:
+                await self._run(client, cmd, timeout, future)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            # anything unexpected fails the command instead of ending the worker
+            except Exception as exc:
+                await self._close(client)
+                if not future.done():
+                    future.set_exception(exc)
+
+    async def _run(self, client, cmd, timeout, future):
+        if not client.is_connected:
+            try:
+                # the login reply has no timeout of its own
+                await asyncio.wait_for(client.connect(), self.timeout)
+            except Exception as exc:
+                await self._close(client)
+                # the caller might have stopped waiting during the connect
+                if not future.done():
+                    future.set_exception(exc)
+                await asyncio.sleep(self.reconnect_delay)
+                return
+        try:
+            result = await client.send_cmd(cmd, timeout)
+        except Exception as exc:
+            await self._close(client)
+            if not future.done():
+                future.set_exception(exc)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    async def send_cmd(self, cmd: str, priority=10, timeout=None) -> tuple:
+        """
+        Queues cmd and returns its reply like TERPRCon.send_cmd once it has been run.
+        timeout is the time in seconds to wait for the reply once the command has been sent.
+        """
+        if not self._workers or any(worker.done() for worker in self._workers):
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((priority, next(self._counter), cmd, timeout or self.timeout, future))
+        return await future
+
+    async def safe_send_cmd(self, cmd: str, priority=10, timeout=None, noblank=True) -> tuple:
+        """ Like self.send_cmd but wrapped in a try/error with a default message like TERPRCon.safe_send_cmd """
+        try:
+            response = await self.send_cmd(cmd, priority, timeout)
+            if noblank and response[0] == '':
+                return 'RCon reply was empty.', False
+            else:
+                return response[0], True
+        except Exception as err:
+            if noblank and str(err) == '':
+                return 'RCon command failed.', False
+            else:
+                return str(err), False
+
+
 # non-db classes
+class _Grid:
+    """
+    Uniform grid hashing points into cells of cell_size so that all points within cell_size of a given position can
+    be found by looking at the surrounding cells only. Points can be partitioned further by an optional key.
+    """
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = dict()
+
+    def _cell(self, coords, key=None):
+        return (key,) + tuple(floor(c / self.cell_size) for c in coords)
+
+    def add(self, item, coords, key=None):
+        cell = self._cell(coords, key)
+        if cell in self.cells:
+            self.cells[cell].append(item)
+        else:
+            self.cells[cell] = [item]
+
+    def near(self, coords, key=None, reach=1):
+        """Yields the items of all cells up to reach cells away from the cell containing coords."""
+        key, *center = self._cell(coords, key)
+        for offset in product(range(-reach, reach + 1), repeat=len(center)):
+            cell = self.cells.get((key,) + tuple(c + o for c, o in zip(center, offset)))
+            if cell:
+                yield from cell
+
+    def ring(self, coords, reach, key=None):
+        """Yields the items of all cells exactly reach cells away from the cell containing coords."""
+        key, *center = self._cell(coords, key)
+        if reach == 0:
+            yield from self.cells.get((key,) + tuple(center), [])
+            return
+        # each cell on the ring is enumerated once by the first dimension in which it is reach cells away
+        for dim in range(len(center)):
+            inner, outer = [range(-reach + 1, reach)] * dim, [range(-reach, reach + 1)] * (len(center) - dim - 1)
+            ranges = inner + [(-reach, reach)] + outer
+            for offset in product(*ranges):
+                cell = self.cells.get((key,) + tuple(c + o for c, o in zip(center, offset)))
+                if cell:
+                    yield from cell
+
+    def max_reach(self, coords, key=None):
+        """Returns the number of rings around coords that need to be checked to cover every cell of the grid."""
+        key, *center = self._cell(coords, key)
+        reach = 0
+        for cell in self.cells:
+            if cell[0] == key:
+                reach = max(reach, max(abs(c - o) for c, o in zip(cell[1:], center)))
+        return reach
+
+
+class LogTail:
+    """
+    Reads the records appended to one of the logs handled by ChatLogs since the last read.
+    The checkpoint stores the identity of the file being read, the byte offset reached, the date of the last record and
+    the name of the newest backup at that time. That allows finishing a file that has been renamed to a -backup- file
+    and possibly compressed since the last read and picking up the new one afterwards.
+    """
+    def __init__(self, path, name, checkpoint=None):
+        self.path = path
+        self.name = name
+        self.checkpoint = checkpoint or {}
+
+    @staticmethod
+    def _get_identity(filename):
+        stat = os.stat(filename)
+        return [stat.st_dev, stat.st_ino]
+
+    @staticmethod
+    def _get_log_name(filename):
+        """Returns the name of a log file before it was compressed."""
+        name = os.path.basename(filename)
+        for extension in COMPRESSED_EXTENSIONS:
+            if name.endswith(extension):
+                return name[:-len(extension)]
+        return name
+
+    def _get_backups(self):
+        """Returns the paths of all backups of the log ordered from oldest to newest."""
+        prefix = f'{self.name}-backup-'
+        backups = dict()
+        # a backup being compressed exists twice for a moment, the uncompressed file sorts first and is complete
+        for filename in sorted(filename for filename in os.listdir(self.path) if filename.startswith(prefix)):
+            backups.setdefault(self._get_log_name(filename), os.path.join(self.path, filename))
+        return list(backups.values())
+
+    def _read(self, filename, offset=0):
+        """Parses all complete lines after offset and returns the records together with the new offset."""
+        records = []
+        with open_log(filename, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read()
+        # an incomplete last line is still being written and will be read the next time
+        end = chunk.rfind(b'\n') + 1
+        line_number = 0
+        for line_number, raw in enumerate(chunk[:end].splitlines(), start=1):
+            line = raw.decode('utf-8-sig' if offset == 0 and line_number == 1 else 'utf-8', errors='replace')
+            # skip everything that is not a record such as the lines added when the log is opened or closed
+            if not line.startswith('{' if self.name != 'ConanSandbox' else '['):
+                continue
+            try:
+                data = ChatLogs._parse_line(self.name, line + '\n')
+            except Exception:
+                print(f"Failed loading JSON from {filename} at byte {offset}, line {line_number}")
+                continue
+            if data:
+                records.append(data)
+        return records, offset + end
+
+    def read(self):
+        """Returns all records appended since the last read and updates the checkpoint."""
+        current = os.path.join(self.path, self.name + '.log')
+        if not os.path.isfile(current):
+            return []
+        identity = self._get_identity(current)
+        checkpoint = self.checkpoint
+        backups = self._get_backups()
+        names = [self._get_log_name(backup) for backup in backups]
+        # backups are named by the date of their rotation so the oldest one created since the last read is the file
+        # read last time, which is found by its name even if compressing it replaced it by a new file
+        rotated = None
+        if 'backup' in checkpoint:
+            last_backup = checkpoint['backup']
+            rotated = [backup for backup, name in zip(backups, names) if last_backup is None or name > last_backup]
+        records, offset, lost = [], 0, False
+        if checkpoint.get('id') == identity and not rotated:
+            offset = checkpoint.get('offset', 0)
+            # the file was truncated or replaced, so start over from the beginning
+            if os.path.getsize(current) < offset:
+                offset = 0
+        elif rotated:
+            # the file read last time has been rotated, so finish it and read all backups created after it
+            records += self._read(rotated[0], checkpoint.get('offset', 0))[0]
+            for backup in rotated[1:]:
+                records += self._read(backup)[0]
+        elif checkpoint:
+            # checkpoints without the name of the newest backup can only find an uncompressed backup by its identity
+            identities = [self._get_identity(backup) for backup in backups]
+            if checkpoint.get('id') in identities:
+                idx = identities.index(checkpoint['id'])
+                records += self._read(backups[idx], checkpoint.get('offset', 0))[0]
+                for backup in backups[idx + 1:]:
+                    records += self._read(backup)[0]
+            # if it can't be found anymore fall back to the date of the last record read
+            else:
+                lost = True
+                for backup in backups:
+                    records += self._read(backup)[0]
+        new_records, offset = self._read(current, offset)
+        records += new_records
+        if lost and checkpoint.get('date'):
+            last_date = datetime.fromisoformat(checkpoint['date'])
+            records = [data for data in records if data['datetime'] > last_date]
+        last_date = records[-1]['datetime'].isoformat() if records else checkpoint.get('date')
+        self.checkpoint = {'id': identity, 'offset': offset, 'date': last_date, 'backup': max(names, default=None)}
+        return records
+
+
 class ChatLogs:
-    def __init__(self, path, after_date=None):
+    _executor = None
+    # worker processes import the whole package when they start, so they're kept for all instances and calls
+    _process_executor = None
+    _process_workers = None
+
+    def __init__(self, path, after_date=None, bisect=False, workers=None):
         self.path = path
+        # if True, seek the first line after after_date by binary search instead of parsing every line up to it
+        self.bisect = bisect
+        # if more than one, get_lines parses each file in its own process using up to that many processes
+        self.workers = workers
         # format: self.files['ConanSandbox'][2]['name'] == 'ConanSandbox-backup-2022.11.01-02.33.01.log'
         self.files = {'ConanSandbox': [], 'Chat': [], 'Commands': []}
         # add one second to account for lost split seconds in the log
@@ -254,56 +899,134 @@ class ChatLogs:
                     self.files[name].insert(0, {'name': filename, 'date': date})
 
     def _populate_lines_cache(self, name, log_type='chat'):
-        for file in sorted(self.files[name], key=lambda item: item['date']):
-            if not self.after_date or file['date'] > self.after_date:
-                filename = os.path.join(self.path, file['name'])
-                with open(filename, 'r', encoding='utf-8-sig') as f:
-                    lines = f.readlines()
-                for line in lines[1:-1]:
-                    # Old style ConanSandbox.log parsing
-                    if name == 'ConanSandbox':
-                        """
-                        Example Chat (ConanSandbox.log)
-                        [2000.01.01-12.00.00:000][Pippi]PippiChat: Alice said in channel [Alice:Bob]: Hello Bob!
-                                                                   ^div_1                          ^div_2
-                        """
-                        if line[0] == '[':
-                            date = self.get_date(line)
-                            if (not self.after_date or date > self.after_date) and '[Pippi]PippiChat: ' in line:
-                                data = {'datetime': date}
-                                div_1 = 43
-                                div_2 = line.find(']:', div_1)
-                                data['name'], channel = line[div_1:div_2].split(" said in channel [")
-                                if channel in ('Global', 'Local', 'Emote', 'Shout', 'Mumble') or ':' in channel:
-                                    data['channel'] = channel
-                                else:
-                                    data['channel'] = 'Guild'
-                                data['type'] = 'Chat'
-                                data['content'] = line[div_2+3:-1]
-                                if '"' in data['content']:
-                                    data['content'] = data['content'].replace('"', "'")
-                                for c in ';\n\r':
-                                    if c in data['content']:
-                                        data['content'] = data['content'].replace(c, '')
-                                self.chat_lines.append(data)
-
-                    # New JSON style Chat.log parsing
+        for data in self._iter_log(name, self.after_date):
+            if log_type == 'chat':
+                self.chat_lines.append(data)
+            else:
+                self.command_lines.append(data)
+
+    def _populate_lines_cache_parallel(self, logs):
+        """
+        Like calling _populate_lines_cache for each (name, log_type) in logs but parses every file in a worker process.
+        The results are collected in the same order the serial path reads the files, so the caches end up identical.
+        """
+        executor = ChatLogs._get_process_executor(self.workers)
+        futures = []
+        try:
+            for name, log_type in logs:
+                for filename in self._get_log_files(name, self.after_date):
+                    offset = self._get_offset(name, filename, self.after_date)
+                    futures.append((log_type, executor.submit(parse_file, name, filename, self.after_date, offset)))
+            for log_type, future in futures:
+                if log_type == 'chat':
+                    self.chat_lines.extend(future.result())
+                else:
+                    self.command_lines.extend(future.result())
+        except BrokenProcessPool:
+            # a pool whose worker died can't be used anymore, so start a new one next time
+            ChatLogs._process_executor = None
+            raise
+
+    @staticmethod
+    def _get_process_executor(workers):
+        """Returns the process pool shared by all instances, replacing it if the number of workers changed."""
+        if ChatLogs._process_executor and ChatLogs._process_workers != workers:
+            ChatLogs._process_executor.shutdown()
+            ChatLogs._process_executor = None
+        if not ChatLogs._process_executor:
+            ChatLogs._process_executor = ProcessPoolExecutor(max_workers=workers)
+            ChatLogs._process_workers = workers
+        return ChatLogs._process_executor
+
+    def _get_log_files(self, name, after_date=None):
+        """Returns the paths of all files of the given log that may hold records after after_date, oldest first."""
+        files = sorted(self.files[name], key=lambda item: item['date'])
+        return [os.path.join(self.path, file['name']) for file in files if not after_date or file['date'] > after_date]
+
+    def _iter_log(self, name, after_date=None):
+        """Lazily yields the records of all files of the given log from the oldest file to the newest."""
+        for filename in self._get_log_files(name, after_date):
+            yield from self._iter_file(name, filename, after_date)
+
+    def _get_offset(self, name, filename, after_date=None):
+        """Returns the byte offset reading the file can start at."""
+        # compressed files can't be seeked efficiently and are always read from the start
+        if not self.bisect or not after_date or filename.endswith(COMPRESSED_EXTENSIONS):
+            return 0
+        return self._bisect_file(name, filename, after_date)
+
+    def _iter_file(self, name, filename, after_date=None):
+        """Lazily yields the records of a single log file without its first and last line."""
+        return iter_file(name, filename, after_date, self._get_offset(name, filename, after_date))
+
+    @staticmethod
+    def _get_line_date(name, line):
+        """Returns the date of a raw line of the given log without parsing the rest of it or None if it has none."""
+        if name == 'ConanSandbox':
+            return ChatLogs.get_date(line[:25].decode('utf-8', errors='replace')) if line.startswith(b'[') else None
+        idx = line.find(b'"datetime"')
+        if idx < 0:
+            return None
+        start = line.find(b'"', idx + 10) + 1
+        return ChatLogs.get_date({'datetime': line[start:start + 23].decode()}, string_style=False)
+
+    def _bisect_file(self, name, filename, after_date, block_size=65536):
+        """
+        Returns the byte offset of a line dated no later than after_date close to the first one after it.
+        Reading can start there without missing lines as long as the log has been written in time order.
+        """
+        with open(filename, 'rb') as f:
+            low, high = 0, os.path.getsize(filename)
+            while high - low > block_size:
+                mid = (low + high) // 2
+                f.seek(mid)
+                # the line at mid is most likely incomplete, so resync to the start of the next line
+                f.readline()
+                # lines without date such as multiline log messages are skipped
+                date = None
+                pos = f.tell()
+                while pos < high:
+                    date = self._get_line_date(name, f.readline())
+                    if date:
+                        break
+                    pos = f.tell()
+                if date and pos < high and date <= after_date:
+                    low = pos
+                else:
+                    high = mid
+        return low
+
+    @staticmethod
+    def _parse_line(name, line):
+        """
+        Returns the record of a single line of the given log or None if the line isn't a chat or command record.
+        Raises an exception if a line of the JSON style logs can't be parsed.
+        """
+        return parse_line(name, line)
+
+    def tail_lines(self, checkpoint_name="CHATLOG_CHECKPOINTS"):
+        """
+        Like get_lines but only reads what has been appended to the logs since the last call.
+        The position reached in each log is stored as checkpoint in GlobalVars under checkpoint_name.
+        """
+        self.chat_lines, self.command_lines = [], []
+        value = GlobalVars.get_value(checkpoint_name)
+        checkpoints = json.loads(value) if value else {}
+        for name, log_type in (('ConanSandbox', 'chat'), ('Chat', 'chat'), ('Commands', 'command')):
+            tail = LogTail(self.path, name, checkpoints.get(name))
+            for data in tail.read():
+                if not self.after_date or data['datetime'] > self.after_date:
+                    if log_type == 'chat':
+                        self.chat_lines.append(data)
                     else:
-                        try:
-                            data = json.loads(line)
-                        except Exception:
-                            print(f"Failed loading JSON from {filename}:{lines.index(line)+1}")
-                            continue
-
-                        date = self.get_date(data, string_style=False)
-                        data['datetime'] = date
-                        if (not self.after_date or date > self.after_date):
-                            if log_type == 'chat':
-                                self.chat_lines.append(data)
-                            else:
-                                self.command_lines.append(data)
-
-    def _cycle_files(self, keep_files, name):
+                        self.command_lines.append(data)
+            checkpoints[name] = tail.checkpoint
+        GlobalVars.set_value(checkpoint_name, json.dumps(checkpoints))
+        # sort chat lines by datetime (oldest first)
+        self.chat_lines = sorted(self.chat_lines, key=itemgetter('datetime'))
+        self.command_lines = sorted(self.command_lines, key=itemgetter('datetime'))
+
+    def _cycle_files(self, keep_files, name, compress=None):
         while len(self.files[name]) >= keep_files:
             oldest_file = self.files[name][-1]
             path = os.path.join(self.path, oldest_file['name'])
@@ -362,34 +1085,89 @@ class ChatLogs:
             print(f"Failed to create {name}.log.\n{str(exc)}")
             return False
 
+        # compress the new backup only once the new log has been created
+        if compress and len(self.files[name]) > 0:
+            try:
+                self.files[name][0]['name'] = os.path.basename(self._compress(dst_path, compress))
+            except Exception as exc:
+                print(f"Failed to compress {name}-backup-{last_edit}.log.\n{str(exc)}")
+                return False
+
         return True
 
     def get_lines(self, after_date=None):
         self.chat_lines, self.command_lines = [], []
         after_date = after_date + timedelta(seconds=1) if after_date else self.after_date
         # iterate through files from oldest to newest
-        self._populate_lines_cache('ConanSandbox', 'chat')
-        self._populate_lines_cache('Chat', 'chat')
-        self._populate_lines_cache('Commands', 'command')
+        logs = (('ConanSandbox', 'chat'), ('Chat', 'chat'), ('Commands', 'command'))
+        if self.workers and self.workers > 1:
+            self._populate_lines_cache_parallel(logs)
+        else:
+            for name, log_type in logs:
+                self._populate_lines_cache(name, log_type)
         # sort chat lines by datetime (oldest first)
         self.chat_lines = sorted(self.chat_lines, key=itemgetter('datetime'))
         self.command_lines = sorted(self.command_lines, key=itemgetter('datetime'))
 
-    def cycle_log_files(self, keep_files=3):
+    def iter_lines(self, kind='chat', after_date=None):
+        """
+        Lazily yields either the chat or the command records of all logs ordered by their datetime (oldest first).
+        Each log is read as an already ordered stream of its files and the logs are merged, so only the files
+        currently being read are open and only one record per log is held in memory at any time.
+        """
+        if kind not in ('chat', 'command'):
+            raise ValueError("kind must be either 'chat' or 'command'.")
+        after_date = after_date + timedelta(seconds=1) if after_date else self.after_date
+        names = ('ConanSandbox', 'Chat') if kind == 'chat' else ('Commands',)
+        return merge(*(self._iter_log(name, after_date) for name in names), key=itemgetter('datetime'))
+
+    def cycle_log_files(self, keep_files=3, compress=None, background=False):
+        """
+        Renames the current Chat.log and Commands.log to -backup- files and deletes the oldest ones. If compress is
+        'gz' or 'zst' the new backups are compressed to .log.gz or .log.zst files.
+        If background is True the logs are cycled one after another in a background thread, so retrying to access
+        files locked by the server doesn't block the caller, and a list with one future per log is returned whose
+        result is False if cycling that log failed. The file cache of this instance is changed by that thread, so
+        callers must wait for all futures before reading any lines through it.
+        """
+        if compress not in (None, 'gz', 'zst'):
+            raise ValueError("compress must be either None, 'gz' or 'zst'.")
+        if compress == 'zst' and zstandard is None:
+            raise ImportError("zstandard is required to compress logs with zst.")
         names = ['Chat', 'Commands']
-        for name in names:
-            self._cycle_files(keep_files, name)
+        if not background:
+            for name in names:
+                self._cycle_files(keep_files, name, compress)
+            return
+        if not ChatLogs._executor:
+            ChatLogs._executor = ThreadPoolExecutor(max_workers=1)
+        return [ChatLogs._executor.submit(self._cycle_files, keep_files, name, compress) for name in names]
+
+    @staticmethod
+    def _compress(path, compress):
+        """Compresses the file at path to path.gz or path.zst, removes the original and returns the new path."""
+        directory, filename = os.path.split(path)
+        dst_path = f"{path}.{compress}"
+        # compress to a temporary file that's not recognised as log so a partial file is never read
+        tmp_path = os.path.join(directory, f".{filename}.{compress}.tmp")
+        with open(path, 'rb') as src:
+            if compress == 'gz':
+                with gzip.open(tmp_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            else:
+                with open(tmp_path, 'wb') as dst:
+                    zstandard.ZstdCompressor().copy_stream(src, dst)
+        os.replace(tmp_path, dst_path)
+        os.remove(path)
+        return dst_path
 
     @staticmethod
     def get_date(data, string_style=True):
         if string_style:
-            try:
-                return datetime.strptime(data[1:24], '%Y.%m.%d-%H.%M.%S:%f')
-            except Exception:
-                return None
+            return parse_date(data[1:24]) if isinstance(data, str) else None
         else:
             try:
-                return datetime.strptime(data['datetime'], '%Y.%m.%d-%H.%M.%S:%f')
+                return parse_date(data['datetime'])
             except Exception:
                 return None
 
@@ -416,6 +1194,229 @@ class ChatLogs:
             print(e)
 
 
+class ChatArchive:
+    """
+    Persistent archive of chat and command records with a full-text index on the content, name and channel.
+    Records are stored as returned by ChatLogs.get_chat_info and identified by their datetime, name and content,
+    so adding the same records again doesn't create duplicates. Commands keep the command in the channel column
+    and the params in the content column. The archive is kept in the supplemental.db unless another uri is given.
+    """
+    date_format = "%Y-%m-%d %H:%M:%S.%f"
+
+    def __init__(self, uri=None):
+        self.engine = create_engine(uri, echo=ECHO) if uri else engines["usersdb"]
+        with self.engine.begin() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_archive ("
+                "id INTEGER PRIMARY KEY, datetime TEXT NOT NULL, name TEXT NOT NULL, channel TEXT, type TEXT, "
+                "content TEXT NOT NULL, UNIQUE (datetime, name, content))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS chat_archive_name ON chat_archive (name, datetime)")
+            # external content table, the index only holds the tokens and reads the text from chat_archive
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chat_archive_fts "
+                "USING fts5(name, channel, content, content='chat_archive', content_rowid='id')"
+            )
+            # the triggers only fire for rows that actually have been inserted or deleted
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS chat_archive_ai AFTER INSERT ON chat_archive BEGIN "
+                "INSERT INTO chat_archive_fts (rowid, name, channel, content) "
+                "VALUES (new.id, new.name, new.channel, new.content); END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS chat_archive_ad AFTER DELETE ON chat_archive BEGIN "
+                "INSERT INTO chat_archive_fts (chat_archive_fts, rowid, name, channel, content) "
+                "VALUES ('delete', old.id, old.name, old.channel, old.content); END"
+            )
+
+    def add(self, records, batch_size=CHUNK_SIZE):
+        """
+        Adds the given records from ChatLogs.chat_lines, command_lines or iter_lines in batches of batch_size
+        records per transaction. Returns the number of records that weren't archived before.
+        """
+        num, batch = 0, []
+        for data in records:
+            info = ChatLogs.get_chat_info(data, self.date_format)
+            if info:
+                batch.append(info)
+            if len(batch) >= batch_size:
+                num += self._insert(batch)
+                batch = []
+        if batch:
+            num += self._insert(batch)
+        return num
+
+    def _insert(self, batch):
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                "INSERT OR IGNORE INTO chat_archive (datetime, name, channel, type, content) VALUES (?, ?, ?, ?, ?)",
+                batch
+            )
+        return result.rowcount
+
+    def get_last_date(self):
+        """Returns the datetime of the most recent archived record or None if the archive is empty."""
+        with self.engine.begin() as conn:
+            value = conn.execute("SELECT MAX(datetime) FROM chat_archive").scalar()
+        return datetime.strptime(value, self.date_format) if value else None
+
+    def add_logs(self, logs, after_date=None):
+        """
+        Adds all chat and command records of the ChatLogs logs after after_date and returns the number of new records.
+        If no after_date is given only the records since the most recent archived one are read.
+        """
+        if not after_date:
+            last_date = self.get_last_date()
+            # records of the same second as the last one might not have been archived yet, duplicates are ignored
+            after_date = last_date - timedelta(seconds=2) if last_date else None
+        return self.add(logs.iter_lines('chat', after_date)) + self.add(logs.iter_lines('command', after_date))
+
+    def search(self, text=None, name=None, channel=None, after=None, before=None, limit=100):
+        """
+        Returns up to limit records as tuples of (datetime, name, channel, type, content) ordered from newest to oldest.
+        text is searched for as phrase in the content, name and channel have to match exactly and after and before
+        are datetimes limiting the time range. Any filter that is None is ignored.
+        """
+        conditions, params = [], []
+        if text:
+            # quote text so it's searched for as phrase instead of being interpreted as fts5 query syntax
+            conditions.append("id IN (SELECT rowid FROM chat_archive_fts WHERE chat_archive_fts MATCH ?)")
+            params.append('content : "' + text.replace('"', '""') + '"')
+        if name:
+            conditions.append("name = ?")
+            params.append(name)
+        if channel:
+            conditions.append("channel = ?")
+            params.append(channel)
+        if after:
+            conditions.append("datetime > ?")
+            params.append(after.strftime(self.date_format))
+        if before:
+            conditions.append("datetime < ?")
+            params.append(before.strftime(self.date_format))
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        query = f"SELECT datetime, name, channel, type, content FROM chat_archive {where}ORDER BY datetime DESC LIMIT ?"
+        with self.engine.begin() as conn:
+            return [tuple(row) for row in conn.execute(query, (*params, limit)).all()]
+
+
+class ChatLogWatcher:
+    """
+    Watches the logs for appended chat and command records and pushes them to subscribers as soon as they're written.
+    Every interval seconds only the current log files are stat'ed and only if one of them changed the appended bytes
+    are read through a LogTail. New records are delivered ordered by datetime to the registered callbacks and to
+    all consumers iterating over records() with async for. Each consumer gets a queue of up to maxsize records and
+    reading the logs pauses while a queue is full, so slow consumers apply backpressure instead of piling up records.
+    Reading starts where the given checkpoints (as returned by the checkpoints property) left off or at the current
+    end of the logs if there are none.
+    """
+    # the kind of records each watched log contains
+    names = {'ConanSandbox': 'chat', 'Chat': 'chat', 'Commands': 'command'}
+
+    def __init__(self, path, interval=0.5, maxsize=1000, checkpoints=None):
+        self.interval = interval
+        self.maxsize = maxsize
+        self.tails = {name: LogTail(path, name, (checkpoints or {}).get(name)) for name in ChatLogWatcher.names}
+        self._callbacks = []
+        self._queues = []
+        self._stats = {}
+        self._task = None
+
+    @property
+    def checkpoints(self):
+        return {name: tail.checkpoint for name, tail in self.tails.items()}
+
+    def add_callback(self, callback, kind=None):
+        """Calls callback (a function or coroutine function) with every new record of the given kind or all records."""
+        self._callbacks.append((callback, kind))
+
+    def remove_callback(self, callback):
+        self._callbacks = [(cb, kind) for cb, kind in self._callbacks if cb != callback]
+
+    async def records(self, kind=None):
+        """Yields every new 'chat' or 'command' record or all records until the watcher is stopped."""
+        queue = asyncio.Queue(self.maxsize)
+        self._queues.append((queue, kind))
+        try:
+            while True:
+                data = await queue.get()
+                # None is put into the queue when the watcher is stopped
+                if data is None:
+                    return
+                yield data
+        finally:
+            self._queues = [(q, k) for q, k in self._queues if q is not queue]
+
+    def __aiter__(self):
+        return self.records()
+
+    def _has_changed(self, name):
+        filename = os.path.join(self.tails[name].path, name + '.log')
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if self._stats.get(name) == identity:
+            return False
+        self._stats[name] = identity
+        return True
+
+    async def poll(self):
+        """Reads the appended records of all logs that changed since the last poll and delivers them."""
+        loop = asyncio.get_running_loop()
+        records = []
+        for name, kind in ChatLogWatcher.names.items():
+            if self._has_changed(name):
+                # reading and parsing a large chunk could take a while, so it's done in a thread
+                records += [(data, kind) for data in await loop.run_in_executor(None, self.tails[name].read)]
+        records.sort(key=lambda item: item[0]['datetime'])
+        for data, kind in records:
+            for callback, callback_kind in self._callbacks:
+                if callback_kind in (None, kind):
+                    result = callback(data)
+                    if asyncio.iscoroutine(result):
+                        await result
+            for queue, queue_kind in self._queues:
+                if queue_kind in (None, kind):
+                    await queue.put(data)
+        return len(records)
+
+    async def run(self):
+        """Polls the logs every interval seconds until cancelled. Use start() to run it as background task."""
+        loop = asyncio.get_running_loop()
+        # without checkpoint the logs are read once so only records written from now on are delivered
+        for name, tail in self.tails.items():
+            if not tail.checkpoint:
+                self._has_changed(name)
+                await loop.run_in_executor(None, tail.read)
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"Failed to read the logs.\n{str(exc)}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if not self._task or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        """Stops watching and ends the iteration of all consumers once they've processed their queued records."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for queue, _ in self._queues:
+            await queue.put(None)
+
+
 class Owner:
     @staticmethod
     def exists(owner_id):
@@ -464,38 +1465,54 @@ class Owner:
     def has_tiles(self):
         return True if session.query(Buildings.object_id).filter_by(owner_id=self.id).first() else False
 
-    def tiles(self, bMult=1, pMult=1):
-        if not self.has_tiles():
-            return tuple()
-        bTiles = tuple(
-            BuildingTiles(owner_id=self.id,
-                          object_id=res[0],
-                          amount=res[1]*bMult)
-            for res in session.query(Buildings.object_id, func.count(Buildings.object_id))
-                              .filter(Buildings.owner_id == self.id, Buildings.object_id == BuildingInstances.object_id)
-                              .group_by(Buildings.object_id).all())
-        root = tuple(
-            res[0] for res in session.query(distinct(Buildings.object_id)).filter(
-                Buildings.owner_id == self.id, Buildings.object_id == BuildingInstances.object_id
-            ).all()
-        )
-        if pMult == 0:
-            return bTiles
+    @staticmethod
+    def tiles_many(owner_ids, bMult=1, pMult=1):
+        """
+        Returns the tiles of any number of owners as a dict of tuples indexed by owner_id.
+        Owners without any tiles are included with an empty tuple.
+        """
+        if not isinstance(owner_ids, ITER):
+            owner_ids = (owner_ids,)
+        owner_ids = tuple(dict.fromkeys(owner_ids))
+        building_tiles = {owner_id: [] for owner_id in owner_ids}
+        placeables = {owner_id: [] for owner_id in owner_ids}
+        B = Buildings
+        BI = BuildingInstances
+        for idx in range(0, len(owner_ids), CHUNK_SIZE):
+            chunk = owner_ids[idx:idx + CHUNK_SIZE]
+            # objects that have an object_id in both Buildings and BuildingInstances are root object building tiles
+            query = session.query(B.object_id, B.owner_id, func.count(B.object_id)) \
+                           .filter(B.owner_id.in_(chunk), B.object_id == BI.object_id).group_by(B.object_id)
+            for object_id, owner_id, count in query.all():
+                tile = BuildingTiles(owner_id=owner_id, object_id=object_id, amount=count*bMult)
+                building_tiles[owner_id].append(tile)
+            if pMult == 0:
+                continue
+            # all other objects are placeables
+            root = exists().where(BI.object_id == B.object_id)
+            query = session.query(B.object_id, B.owner_id).filter(B.owner_id.in_(chunk), ~root)
+            for object_id, owner_id in query.all():
+                placeables[owner_id].append(Placeables(owner_id=owner_id, object_id=object_id, amount=pMult))
+        return {owner_id: tuple(building_tiles[owner_id] + placeables[owner_id]) for owner_id in owner_ids}
 
-        pTiles = tuple(
-            Placeables(owner_id=self.id,
-                       object_id=res[0],
-                       amount=pMult)
-            for res in session.query(Buildings.object_id)
-                              .filter(Buildings.owner_id == self.id, Buildings.object_id.notin_(root)).all())
-        return bTiles + pTiles
+    @staticmethod
+    def num_tiles_many(owner_ids, bMult=1, pMult=1, r=True):
+        """
+        Returns the number of tiles of any number of owners as a dict indexed by owner_id.
+        """
+        num_tiles = dict()
+        for owner_id, tiles in Owner.tiles_many(owner_ids, bMult, pMult).items():
+            sum = 0
+            for t in tiles:
+                sum += t.amount
+            num_tiles[owner_id] = int(round(sum, 0)) if r else sum
+        return num_tiles
+
+    def tiles(self, bMult=1, pMult=1):
+        return Owner.tiles_many(self.id, bMult, pMult)[self.id]
 
     def num_tiles(self, bMult=1, pMult=1, r=True):
-        tiles = self.tiles(bMult, pMult)
-        sum = 0
-        for t in tiles:
-            sum += t.amount
-        return int(round(sum, 0)) if r else sum
+        return Owner.num_tiles_many(self.id, bMult, pMult, r)[self.id]
 
 
 class Tiles:
@@ -633,41 +1650,254 @@ class PropertiesList(tuple):
         return Owner.get(id)
 
 
-class TilesManager:
+class SpatialIndex:
+    """
+    R*Tree index over the positions in actor_position of a db kept in a sidecar db next to it.
+    The index is opt-in and is only created and brought up to date by calling update(), e.g. after each restart.
+    Buildings.copy, Buildings.delete and Buildings.give_to_owner only use it for location filters while it's current
+    and fall back to filtering actor_position otherwise.
+    """
+    def __init__(self, db=GAME_DB):
+        self.db_path = SAVED_DIR_PATH + '/' + db
+        self.path = os.path.splitext(self.db_path)[0] + '.spatial.db'
+
+    @property
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    @property
+    def is_current(self):
+        """True if the index exists and the indexed db hasn't changed since the last update()."""
+        if not self.exists:
+            return False
+        engine = create_engine("sqlite:///" + self.path, echo=ECHO)
+        with engine.begin() as conn:
+            identity = conn.execute("SELECT value FROM meta WHERE name = 'identity'").scalar()
+        engine.dispose()
+        return identity == self._get_identity()
+
+    def _get_identity(self):
+        # changes to the db might only be in the write-ahead log until the next checkpoint
+        identity = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                identity += [stat.st_mtime_ns, stat.st_size]
+        return ' '.join(map(str, identity))
+
+    def update(self):
+        """
+        Creates the index or brings it up to date with the indexed db by only replacing the positions that changed.
+        Returns the number of added, moved or removed positions.
+        """
+        engine = create_engine("sqlite:///" + self.path, echo=ECHO)
+        identity = self._get_identity()
+        with engine.begin() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            # positions keeps the exact coordinates since the rtree itself only stores them with 32 bit precision
+            conn.execute("CREATE TABLE IF NOT EXISTS positions (id INTEGER PRIMARY KEY, x REAL, y REAL, z REAL)")
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS actor_rtree "
+                "USING rtree(id, min_x, max_x, min_y, max_y, min_z, max_z)"
+            )
+            last_identity = conn.execute("SELECT value FROM meta WHERE name = 'identity'").scalar()
+        if last_identity == identity:
+            engine.dispose()
+            return 0
+
+        with engine.begin() as conn:
+            conn.execute(f"ATTACH DATABASE '{self.db_path}' AS 'src'")
+            conn.execute(
+                "CREATE TEMPORARY TABLE changed AS "
+                "SELECT a.id, a.x, a.y, a.z FROM src.actor_position AS a LEFT JOIN positions AS p ON p.id = a.id "
+                "WHERE p.id IS NULL OR p.x IS NOT a.x OR p.y IS NOT a.y OR p.z IS NOT a.z"
+            )
+            conn.execute(
+                "CREATE TEMPORARY TABLE removed AS "
+                "SELECT id FROM positions WHERE id NOT IN (SELECT id FROM src.actor_position)"
+            )
+            changed = "SELECT id FROM temp.changed UNION ALL SELECT id FROM temp.removed"
+            conn.execute(f"DELETE FROM actor_rtree WHERE id IN ({changed})")
+            conn.execute(f"DELETE FROM positions WHERE id IN ({changed})")
+            conn.execute("INSERT INTO positions SELECT id, x, y, z FROM temp.changed")
+            conn.execute(
+                "INSERT INTO actor_rtree SELECT id, x, x, y, y, z, z FROM temp.changed "
+                "WHERE x IS NOT NULL AND y IS NOT NULL AND z IS NOT NULL"
+            )
+            num = conn.execute(f"SELECT COUNT(*) FROM ({changed})").scalar()
+            conn.execute("REPLACE INTO meta (name, value) VALUES ('identity', ?)", (identity,))
+        engine.dispose()
+        return num
+
     @staticmethod
-    def get_tiles_by_owner(bMult=1, pMult=1, do_round=True):
-        # stores all building pieces indexed by their respective owners
-        building_pieces = dict()
-        # store all placeables indexed by their respective owners
-        placeables = dict()
-        # tiles that have an object_id in both Buildings and BuildingInstances are root object building tiles
-        root = set()
+    def get_filter(loc, attach):
+        """
+        Returns a WHERE condition for raw SQL queries selecting all candidate ids within loc from the index
+        attached as attach. The rtree rounds coordinates outwards so the exact filter still needs to be applied.
+        """
+        bounds = [f"max_{c} >= {low} AND min_{c} <= {high}" for c, (low, high) in zip('xyz', loc)]
+        return f"id IN (SELECT id FROM {attach}.actor_rtree WHERE {' AND '.join(bounds)})"
+
+    def query(self, loc):
+        """Returns the ids of all actors within loc."""
+        engine = create_engine("sqlite:///" + self.path, echo=ECHO)
+        with engine.begin() as conn:
+            bounds = [f"{c} BETWEEN {low} AND {high}" for c, (low, high) in zip('xyz', loc)]
+            query = f"SELECT id FROM positions WHERE {self.get_filter(loc, 'main')} AND {' AND '.join(bounds)}"
+            ids = [id for id, in conn.execute(query).all()]
+        engine.dispose()
+        return ids
+
+
+class TileCensus:
+    """
+    All building tiles and placeables with their owner, number of building pieces and position stored in parallel
+    columns. The census is read with one query per table and cached until the game.db changes.
+    Placeables have a count of 0 and building tiles without a position have nan coordinates.
+    """
+    _cache = None
+    _identity = None
+    _conn = None
+
+    def __init__(self):
+        self.object_ids = array('q')
+        self.owner_ids = array('q')
+        self.counts = array('q')
+        self.x = array('d')
+        self.y = array('d')
+        self.z = array('d')
+        self.classes = []
+        self._grids = dict()
+
+        AP = ActorPosition
+        B = Buildings
+        BI = BuildingInstances
         # res has format (object_id, owner_id, count(object_id)) contains only building tiles and their aggregated obj
-        for res in session.query(Buildings.object_id, Buildings.owner_id, func.count(Buildings.object_id)) \
-                          .filter(Buildings.object_id == BuildingInstances.object_id) \
-                          .group_by(Buildings.object_id).all():
-            # create a new dict entry if owner does not have one yet
-            if not res[1] in building_pieces:
-                building_pieces[res[1]] = res[2] * bMult
-                placeables[res[1]] = 0
-            # add aggregated tiles if one already exists
+        root = session.query(B.object_id, B.owner_id, func.count(B.object_id)) \
+                      .filter(B.object_id == BI.object_id).group_by(B.object_id).all()
+        # res has format (object_id, owner_id, x, y, z, class) contains all building tiles and placeables
+        positioned = session.query(B.object_id, B.owner_id, AP.x, AP.y, AP.z, AP.class_) \
+                            .filter(B.object_id == AP.id).all()
+        positions = {res[0]: idx for idx, res in enumerate(positioned)}
+        nan = float('nan')
+        # building tiles come first followed by all objects that are not root objects, i.e. placeables
+        for object_id, owner_id, count in root:
+            idx = positions.pop(object_id, None)
+            if idx is not None:
+                _, _, x, y, z, class_ = positioned[idx]
+                self._append(object_id, owner_id, count, x, y, z, class_)
             else:
-                building_pieces[res[1]] += res[2] * bMult
-            # remember the object_id as root object in either case
-            root.add(res[0])
-
-        # res has format: (object_id, owner_id) contains all building tiles and placeables
-        for res in session.query(Buildings.object_id, Buildings.owner_id) \
-                          .filter(Buildings.object_id == ActorPosition.id).all():
-            # if object is not a root object, it is a placeable and needs to be added now
-            if not res[0] in root:
-                # if owner is not in tiles (i.e. owner has no building tiles) create a new dict entry
-                if not res[1] in building_pieces:
-                    building_pieces[res[1]] = 0
-                    placeables[res[1]] = pMult
-                # otherwise add it to the count
+                self._append(object_id, owner_id, count, nan, nan, nan, '')
+        for object_id, owner_id, x, y, z, class_ in positioned:
+            if object_id in positions:
+                self._append(object_id, owner_id, 0, x, y, z, class_)
+
+    def _append(self, object_id, owner_id, count, x, y, z, class_):
+        self.object_ids.append(object_id)
+        self.owner_ids.append(owner_id if owner_id is not None else 0)
+        self.counts.append(count)
+        self.x.append(x if x is not None else float('nan'))
+        self.y.append(y if y is not None else float('nan'))
+        self.z.append(z if z is not None else float('nan'))
+        _, _, c = (class_ or '').partition('.')
+        self.classes.append(c)
+
+    def __len__(self):
+        return len(self.object_ids)
+
+    def get_grid(self, cell_size=10000):
+        """Returns a grid over the x and y coordinates of all positioned objects with their index in the census."""
+        if cell_size not in self._grids:
+            grid = _Grid(cell_size)
+            for idx, (x, y) in enumerate(zip(self.x, self.y)):
+                if x == x and y == y:
+                    grid.add(idx, (x, y))
+            self._grids[cell_size] = grid
+        return self._grids[cell_size]
+
+    def distance(self, idx, x, y, z=None):
+        """Returns the distance between the object at idx and the given position, ignoring z if it's None."""
+        if z is None or self.z[idx] != self.z[idx]:
+            return sqrt((self.x[idx] - x)**2 + (self.y[idx] - y)**2)
+        return sqrt((self.x[idx] - x)**2 + (self.y[idx] - y)**2 + (self.z[idx] - z)**2)
+
+    @staticmethod
+    def _get_identity():
+        # data_version changes whenever another connection commits to the db, the file stats cover everything else
+        if TileCensus._conn is None:
+            TileCensus._conn = engines["gamedb"].connect()
+        stat = os.stat(engines["gamedb"].url.database)
+        data_version = TileCensus._conn.execute("PRAGMA data_version").scalar()
+        return stat.st_mtime_ns, stat.st_size, data_version
+
+    @classmethod
+    def get(cls):
+        """
+        Returns the census of the current game.db and only reads it again if the db has changed since.
+        While the session holds changes that haven't been committed yet, the census is read through the session
+        every time so it reflects them, but it isn't cached.
+        """
+        if session.new or session.dirty or session.deleted or session.info.get('uncommitted_writes'):
+            return cls()
+        identity = cls._get_identity()
+        if cls._cache is None or cls._identity != identity:
+            cls._cache = cls()
+            cls._identity = identity
+        return cls._cache
+
+    @classmethod
+    def clear(cls):
+        cls._cache = None
+        cls._identity = None
+
+    def tiles_by_owner(self, bMult=1, pMult=1):
+        """
+        Returns two dicts with the building pieces and placeables indexed by their respective owners.
+        Owners only show up in the dicts for which they have any tiles.
+        """
+        building_pieces, placeables = dict(), dict()
+        for owner_id, count in zip(self.owner_ids, self.counts):
+            if count:
+                if owner_id in building_pieces:
+                    building_pieces[owner_id] += count * bMult
                 else:
-                    placeables[res[1]] += pMult
+                    building_pieces[owner_id] = count * bMult
+            elif owner_id in placeables:
+                placeables[owner_id] += pMult
+            else:
+                placeables[owner_id] = pMult
+        return building_pieces, placeables
+
+
+@event.listens_for(session, 'after_flush')
+def _mark_flush(session, flush_context):
+    session.info['uncommitted_writes'] = True
+
+
+@event.listens_for(session, 'do_orm_execute')
+def _mark_execute(orm_execute_state):
+    # covers Query.update, Query.delete and bulk statements executed through the session
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        orm_execute_state.session.info['uncommitted_writes'] = True
+
+
+@event.listens_for(session, 'after_transaction_end')
+def _clear_writes(session, transaction):
+    # once the outermost transaction is committed or rolled back, the db file tells whether it changed
+    if transaction.parent is None:
+        session.info.pop('uncommitted_writes', None)
+
+
+class TilesManager:
+    @staticmethod
+    def get_tiles_by_owner(bMult=1, pMult=1, do_round=True):
+        # building pieces and placeables indexed by their respective owners
+        census_pieces, census_placeables = TileCensus.get().tiles_by_owner(bMult, pMult)
+        # every owner with any tiles gets an entry in both dicts
+        building_pieces, placeables = dict(), dict()
+        for owner_id in list(census_pieces) + list(census_placeables):
+            building_pieces[owner_id] = census_pieces.get(owner_id, 0)
+            placeables[owner_id] = census_placeables.get(owner_id, 0)
 
         if do_round:
             for owner_id in building_pieces.keys():
@@ -677,27 +1907,25 @@ class TilesManager:
         return building_pieces, placeables
 
     @staticmethod
-    def get_tiles_consolidated(bMult=1, pMult=1, min_dist=50000, do_round=True):
-        AP = ActorPosition
-        B = Buildings
-        BI = BuildingInstances
+    def _get_tiles_to_consolidate(bMult=1, pMult=1):
+        census = TileCensus.get()
         tiles_to_consolidate = dict()
         owner_index = dict()
-        query = (AP.x, AP.y, AP.z, AP.class_, B.object_id, B.owner_id, func.count(B.object_id))
-        filter = (AP.id == B.object_id) & (B.object_id == BI.object_id)
-        # get all Building pieces and their associated coordiantes and owners excluding pure placeables
-        tiles = session.query(*query).filter(filter).group_by(B.object_id)
-        for x, y, z, class_, object_id, owner_id, tiles in tiles.all():
-            _, _, c = class_.partition('.')
+        columns = (census.object_ids, census.owner_ids, census.counts, census.x, census.y, census.z, census.classes)
+        # building pieces come first in the census followed by the placeables
+        for object_id, owner_id, count, x, y, z, c in zip(*columns):
+            # disregard building pieces without a position
+            if x != x:
+                continue
             tiles_to_consolidate[object_id] = {
                 'x': x,
                 'y': y,
                 'z': z,
                 'class': c,
                 'owner_id': owner_id,
-                'tiles': tiles * bMult,
-                'building_pieces': tiles * bMult,
-                'placeables': 0
+                'tiles': count * bMult if count else pMult,
+                'building_pieces': count * bMult if count else 0,
+                'placeables': 0 if count else pMult
             }
             # keep a second dict to allow us to find all the objects belonging to an object_id
             if owner_id in owner_index:
@@ -705,29 +1933,72 @@ class TilesManager:
             else:
                 owner_index[owner_id] = [object_id]
 
-        query = (AP.x, AP.y, AP.z, AP.class_, B.object_id, B.owner_id)
-        filter = (AP.id == B.object_id)
-        # get all placeables and their associated attributes
-        for x, y, z, class_, object_id, owner_id in session.query(*query).filter(filter).all():
-            # disregard building pieces that have already been added in the first loop
-            if object_id in tiles_to_consolidate:
+        return tiles_to_consolidate, owner_index
+
+    @staticmethod
+    def _consolidate_pairwise(object_ids, tiles_to_consolidate, min_dist):
+        """
+        Yields each object that was not within min_dist of a previous one together with all the following objects
+        within min_dist of it by comparing every object with every later one.
+        """
+        # remember which objects were within min_dist of another
+        remove = set()
+        # go through all objects belonging to a single owner
+        for i in range(len(object_ids)):
+            # if object is within min_dist skip to the next
+            if object_ids[i] in remove:
                 continue
-            _, _, c = class_.partition('.')
-            tiles_to_consolidate[object_id] = {
-                'x': x,
-                'y': y,
-                'z': z,
-                'class': c,
-                'owner_id': owner_id,
-                'tiles': pMult,
-                'building_pieces': 0,
-                'placeables': pMult
-            }
-            # update the owner_index with the placeables
-            if owner_id in owner_index:
-                owner_index[owner_id] += [object_id]
-            else:
-                owner_index[owner_id] = [object_id]
+            tile = tiles_to_consolidate[object_ids[i]]
+            consolidated = []
+            # go through all the remaining objects belonging to the same owner
+            for j in range(i + 1, len(object_ids)):
+                other = tiles_to_consolidate[object_ids[j]]
+                # calculate distance to comparison object
+                dist = sqrt((tile['x'] - other['x'])**2 + (tile['y'] - other['y'])**2 + (tile['z'] - other['z'])**2)
+                # if distance is shorter put it on the remove list and consolidate it with the current object
+                if dist <= min_dist:
+                    remove.add(object_ids[j])
+                    consolidated.append(object_ids[j])
+            yield object_ids[i], consolidated
+
+    @staticmethod
+    def _consolidate_grid(object_ids, tiles_to_consolidate, min_dist):
+        """
+        Yields the same result as _consolidate_pairwise but only compares objects in neighbouring grid cells.
+        """
+        grid = _Grid(min_dist)
+        for i, object_id in enumerate(object_ids):
+            tile = tiles_to_consolidate[object_id]
+            grid.add(i, (tile['x'], tile['y'], tile['z']))
+        remove = set()
+        for i, object_id in enumerate(object_ids):
+            if i in remove:
+                continue
+            tile = tiles_to_consolidate[object_id]
+            consolidated = []
+            # only objects following the current one are consolidated, same as with the pairwise comparison
+            for j in sorted(j for j in grid.near((tile['x'], tile['y'], tile['z'])) if j > i):
+                other = tiles_to_consolidate[object_ids[j]]
+                dist = sqrt((tile['x'] - other['x'])**2 + (tile['y'] - other['y'])**2 + (tile['z'] - other['z'])**2)
+                if dist <= min_dist:
+                    remove.add(j)
+                    consolidated.append(object_ids[j])
+            yield object_id, consolidated
+
+    @staticmethod
+    def get_tiles_consolidated(bMult=1, pMult=1, min_dist=50000, do_round=True, method='grid'):
+        """
+        Consolidates all objects of an owner within min_dist of each other into a single entry.
+        method can be 'grid' which uses a spatial hash or 'pairwise' which compares every object with each other.
+        Both return the same result.
+        """
+        if method == 'grid' and min_dist > 0:
+            consolidate = TilesManager._consolidate_grid
+        elif method in ('grid', 'pairwise'):
+            consolidate = TilesManager._consolidate_pairwise
+        else:
+            raise ValueError(f"Unknown consolidation method '{method}'.")
+        tiles_to_consolidate, owner_index = TilesManager._get_tiles_to_consolidate(bMult, pMult)
 
         tiles_consolidated = dict()
         tiles_per_owner = dict()
@@ -737,39 +2008,24 @@ class TilesManager:
         p = 'placeables'
         # do the consolidating
         for owner_id, object_ids in owner_index.items():
-            # remember which objects were within min_dist of another
-            remove = set()
-            # go through all objects belonging to a single owner
-            for i in range(len(object_ids)):
-                # if object is within min_dist skip to the next
-                if object_ids[i] in remove:
-                    continue
-                # if object wasn't removed yet add it to the final list
-                tiles_consolidated[object_ids[i]] = tiles_to_consolidate[object_ids[i]]
-                # go through all the remaining objects belonging to the same owner
-                for j in range(i + 1, len(object_ids)):
-                    # calculate distance to comparison object
-                    dist = sqrt(
-                        (tiles_to_consolidate[object_ids[i]]['x'] - tiles_to_consolidate[object_ids[j]]['x'])**2 +
-                        (tiles_to_consolidate[object_ids[i]]['y'] - tiles_to_consolidate[object_ids[j]]['y'])**2 +
-                        (tiles_to_consolidate[object_ids[i]]['z'] - tiles_to_consolidate[object_ids[j]]['z'])**2
-                    )
-                    # if distance is shorter put it on the remove list and add tiles to current object
-                    if dist <= min_dist:
-                        remove.add(object_ids[j])
-                        tiles_consolidated[object_ids[i]]['tiles'] += tiles_to_consolidate[object_ids[j]]['tiles']
-                        tiles_consolidated[object_ids[i]][bp] += tiles_to_consolidate[object_ids[j]][bp]
-                        tiles_consolidated[object_ids[i]][p] += tiles_to_consolidate[object_ids[j]][p]
+            for object_id, consolidated in consolidate(object_ids, tiles_to_consolidate, min_dist):
+                # objects that weren't consolidated with a previous one are added to the final list
+                tile = tiles_consolidated[object_id] = tiles_to_consolidate[object_id]
+                # add the tiles of all objects within min_dist to the current object
+                for other_id in consolidated:
+                    tile['tiles'] += tiles_to_consolidate[other_id]['tiles']
+                    tile[bp] += tiles_to_consolidate[other_id][bp]
+                    tile[p] += tiles_to_consolidate[other_id][p]
 
                 # for each owner store the absolute number of tiles to tiles_per_owner
                 if owner_id in tiles_per_owner:
-                    tiles_per_owner[owner_id] += tiles_consolidated[object_ids[i]]['tiles']
-                    building_pieces_per_owner[owner_id] += tiles_consolidated[object_ids[i]][bp]
-                    placeables_per_owner[owner_id] += tiles_consolidated[object_ids[i]][p]
+                    tiles_per_owner[owner_id] += tile['tiles']
+                    building_pieces_per_owner[owner_id] += tile[bp]
+                    placeables_per_owner[owner_id] += tile[p]
                 else:
-                    tiles_per_owner[owner_id] = tiles_consolidated[object_ids[i]]['tiles']
-                    building_pieces_per_owner[owner_id] = tiles_consolidated[object_ids[i]][bp]
-                    placeables_per_owner[owner_id] = tiles_consolidated[object_ids[i]][p]
+                    tiles_per_owner[owner_id] = tile['tiles']
+                    building_pieces_per_owner[owner_id] = tile[bp]
+                    placeables_per_owner[owner_id] = tile[p]
 
         # go through all consolidated objects and add the absolute number of tiles for that owner
         for object_id, ctd in tiles_consolidated.items():
@@ -779,6 +2035,114 @@ class TilesManager:
 
         return tiles_consolidated
 
+    @staticmethod
+    def get_bases(bMult=1, pMult=1, min_dist=50000):
+        """
+        Groups all objects of an owner into bases where each object is within min_dist of at least one other object
+        of the same base. Unlike get_tiles_consolidated the result doesn't depend on the order of the objects.
+        Returns a dict indexed by the lowest object_id of each base.
+        """
+        tiles_to_consolidate, _ = TilesManager._get_tiles_to_consolidate(bMult, pMult)
+        object_ids = list(tiles_to_consolidate)
+        # union-find structure over the indices of object_ids with each object starting as its own base
+        parent = list(range(len(object_ids)))
+        size = [1] * len(object_ids)
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def union(i, j):
+            root_i, root_j = find(i), find(j)
+            if root_i == root_j:
+                return
+            if size[root_i] < size[root_j]:
+                root_i, root_j = root_j, root_i
+            parent[root_j] = root_i
+            size[root_i] += size[root_j]
+
+        positions = []
+        for object_id in object_ids:
+            tile = tiles_to_consolidate[object_id]
+            positions.append((tile['x'], tile['y'], tile['z']))
+
+        # a single grid for all owners, objects can only be connected to objects of the same owner. The diagonal of
+        # a cell is min_dist so all objects of a cell belong to the same base without measuring their distances.
+        if min_dist > 0:
+            grid = _Grid(min_dist / sqrt(3))
+            for i, object_id in enumerate(object_ids):
+                grid.add(i, positions[i], key=tiles_to_consolidate[object_id]['owner_id'])
+            cells = grid.cells
+        else:
+            # only objects at the same position are connected
+            cells = dict()
+            for i, object_id in enumerate(object_ids):
+                cells.setdefault((tiles_to_consolidate[object_id]['owner_id'],) + positions[i], []).append(i)
+        for cell in cells.values():
+            for i in cell[1:]:
+                union(cell[0], i)
+
+        if min_dist > 0:
+            # objects within min_dist can be up to two cells apart but the corner cells of that cube are too far away.
+            # Every pair of cells is only looked at once from the one with the lower offset.
+            offsets = [offset for offset in product(range(-2, 3), repeat=3)
+                       if offset > (0, 0, 0) and sum(max(abs(o) - 1, 0)**2 for o in offset) < 3]
+            max_dist = min_dist**2
+            for (key, *center), cell in cells.items():
+                for offset in offsets:
+                    other = cells.get((key,) + tuple(c + o for c, o in zip(center, offset)))
+                    # a single pair within min_dist connects both cells
+                    if not other or find(cell[0]) == find(other[0]):
+                        continue
+                    for i, j in product(cell, other):
+                        (x1, y1, z1), (x2, y2, z2) = positions[i], positions[j]
+                        if (x1 - x2)**2 + (y1 - y2)**2 + (z1 - z2)**2 <= max_dist:
+                            union(i, j)
+                            break
+
+        # collect the members of each base
+        members = dict()
+        for i in range(len(object_ids)):
+            root = find(i)
+            if root in members:
+                members[root].append(object_ids[i])
+            else:
+                members[root] = [object_ids[i]]
+
+        bases = dict()
+        bp = 'building_pieces'
+        p = 'placeables'
+        for ids in members.values():
+            ids.sort()
+            tiles = [tiles_to_consolidate[object_id] for object_id in ids]
+            xs, ys, zs = [t['x'] for t in tiles], [t['y'] for t in tiles], [t['z'] for t in tiles]
+            bases[ids[0]] = {
+                'owner_id': tiles[0]['owner_id'],
+                'object_ids': ids,
+                'x': sum(xs) / len(ids),
+                'y': sum(ys) / len(ids),
+                'z': sum(zs) / len(ids),
+                'loc': ((min(xs), max(xs)), (min(ys), max(ys)), (min(zs), max(zs))),
+                'tiles': sum(t['tiles'] for t in tiles),
+                bp: sum(t[bp] for t in tiles),
+                p: sum(t[p] for t in tiles)
+            }
+
+        # for each owner store the absolute number of tiles over all their bases
+        sums = dict()
+        for base in bases.values():
+            owner_sums = sums.setdefault(base['owner_id'], {'tiles': 0, bp: 0, p: 0})
+            for key in owner_sums:
+                owner_sums[key] += base[key]
+        for base in bases.values():
+            base['sum_tiles'] = sums[base['owner_id']]['tiles']
+            base['sum_building_pieces'] = sums[base['owner_id']][bp]
+            base['sum_placeables'] = sums[base['owner_id']][p]
+
+        return bases
+
 
 class MembersManager:
     @staticmethod
@@ -834,6 +2198,55 @@ class MembersManager:
         return members
 
 
+class WealthManager:
+    @staticmethod
+    def get_wealth(with_chars=False, with_thespians=True):
+        """
+        Returns the Pippi money in bronze of all characters, guilds and thespians as dicts indexed by their ids.
+        All wallets are fetched with a single query and decoded once. Character totals include the thespians they
+        own if with_thespians is True. Guild totals only include their thespians unless with_chars is True.
+        """
+        p_name = "Pippi_WalletComponent_C.walletAmount"
+        # wallets of characters (or any other non-building objects) indexed by their object_id
+        wallets = dict()
+        # wallets of thespians indexed by their object_id and the sum of them indexed by the thespians owner
+        thespians, thespians_per_owner = dict(), dict()
+        # res has format (object_id, owner_id, value) where owner_id is only set for wallets owned by thespians
+        query = (
+            session.query(Properties.object_id, Buildings.owner_id, Properties.value)
+                   .outerjoin(Buildings, Buildings.object_id == Properties.object_id)
+                   .filter(Properties.name == p_name)
+        )
+        rows = query.all()
+        owners = {object_id: owner_id for object_id, owner_id, _ in rows}
+        object_ids, amounts = Properties.decode_wallets((object_id, value) for object_id, _, value in rows)
+        for object_id, bronze in zip(object_ids.tolist(), amounts.tolist()):
+            owner_id = owners[object_id]
+            if owner_id is None:
+                wallets[object_id] = bronze
+            else:
+                thespians[object_id] = bronze
+                thespians_per_owner[owner_id] = thespians_per_owner.get(owner_id, 0) + bronze
+
+        characters, guilds, members = dict(), dict(), list()
+        # character wealth is their own wallet plus the wallets of all thespians they own
+        for char_id, guild_id in session.query(Characters.id, Characters.guild_id).all():
+            characters[char_id] = wallets.get(char_id, 0)
+            if with_thespians:
+                characters[char_id] += thespians_per_owner.get(char_id, 0)
+            if guild_id is not None:
+                members.append((char_id, guild_id))
+        # guild wealth is the sum of all thespians owned by the guild and optionally their members wealth
+        for guild_id, in session.query(Guilds.id).all():
+            guilds[guild_id] = thespians_per_owner.get(guild_id, 0) if with_thespians else 0
+        if with_chars:
+            for char_id, guild_id in members:
+                if guild_id in guilds:
+                    guilds[guild_id] += characters[char_id]
+
+        return {'characters': characters, 'guilds': guilds, 'thespians': thespians}
+
+
 class Mods:
     @staticmethod
     def copy(source_db=GAME_DB, dest_db="dest.db", mod_names=None, inverse=False):
@@ -950,9 +2363,10 @@ class Stats:
         C = Characters
         # determine server wealth and average/median wealth per character
         wealth, wealth_inactive, wealth_active, guild_wealth = [], [], [], 0
+        wealth_by_owner = WealthManager.get_wealth()
         # character wealth includes all wealth tied directly to a character or thespians they own
         for c in session.query(C).order_by(C._last_login.desc()).all():
-            bronze = Properties.get_pippi_money(character_id=c.id, as_number=True)
+            bronze = wealth_by_owner['characters'][c.id]
             # try to exclude admin/support chars with access to the cheat menu from the statistics
             if c.slot == 'active' or c.slot in ('1', '2'):
                 wealth.append(bronze)
@@ -962,45 +2376,14 @@ class Stats:
                     wealth_active.append(bronze)
 
         # guild wealth does not include characters or thespians owned by them
-        for g in session.query(Guilds).all():
-            guild_wealth += Properties.get_pippi_money(guild_id=g.id, with_chars=False, as_number=True)
+        guild_wealth = sum(wealth_by_owner['guilds'].values())
 
         members = MembersManager.get_members(td, d, False)
         # stores all tiles indexed by their respective owners
-        building_tiles, placeables, tiles = {}, {}, {}
-        # tiles that have an object_id in both Buildings and BuildingInstances are root object building tiles
-        root = set()
-        # res has format (object_id, owner_id, count(object_id)) contains only building tiles and their aggregated obj
-        for res in session.query(Buildings.object_id, Buildings.owner_id, func.count(Buildings.object_id)) \
-                          .filter(Buildings.object_id == BuildingInstances.object_id) \
-                          .group_by(Buildings.object_id).all():
-            # create a new dict entry if owner does not have one yet
-            if not res[1] in tiles:
-                tiles[res[1]] = res[2]
-                building_tiles[res[1]] = res[2]
-            # add aggregated tiles if one already exists
-            else:
-                tiles[res[1]] += res[2]
-                building_tiles[res[1]] += res[2]
-            # remember the object_id as root object in either case
-            root.add(res[0])
-
-        # res has format: (object_id, owner_id) contains all building tiles and placeables
-        filter = (Buildings.object_id == ActorPosition.id)
-        for res in session.query(Buildings.object_id, Buildings.owner_id).filter(filter).all():
-            # if object is not a root object, it is a placeable and needs to be added now
-            if not res[0] in root:
-                # create a new dict entry if owner does not have one yet
-                if not res[1] in placeables:
-                    placeables[res[1]] = 1
-                # otherwise add it to the count
-                else:
-                    placeables[res[1]] += 1
-                # same thing for the general tiles dict
-                if not res[1] in tiles:
-                    tiles[res[1]] = 1
-                else:
-                    tiles[res[1]] += 1
+        building_tiles, placeables = TileCensus.get().tiles_by_owner()
+        tiles = dict(building_tiles)
+        for owner_id, amount in placeables.items():
+            tiles[owner_id] = tiles.get(owner_id, 0) + amount
 
         nm, nam = 'numMembers', 'numActiveMembers'
 
@@ -1208,6 +2591,75 @@ class ActorPosition(GameBase):
     def distance_between(pos1, pos2):
         return int(round(sqrt((pos1.x - pos2.x)**2 + (pos1.y - pos2.y)**2 + (pos1.z - pos2.z)**2), 0))
 
+    @staticmethod
+    def _coords(positions):
+        """
+        Returns the coordinates of a sequence of positions given either as objects with x, y and z attributes
+        or as (x, y, z) sequences. Returns an array of shape (n, 3) if NumPy is available or a list of tuples otherwise.
+        """
+        if np is not None and isinstance(positions, np.ndarray):
+            return positions.astype(np.float64).reshape(-1, 3)
+        coords = [(p.x, p.y, p.z) if hasattr(p, 'x') else tuple(p) for p in positions]
+        return np.array(coords, dtype=np.float64).reshape(-1, 3) if np is not None else coords
+
+    @staticmethod
+    def distances_to(positions, pos):
+        """
+        Returns the distances between each of the given positions and pos rounded the same way as distance_to.
+        """
+        x, y, z = ActorPosition._coords((pos,))[0]
+        coords = ActorPosition._coords(positions)
+        if np is not None:
+            dx, dy, dz = coords[:, 0] - x, coords[:, 1] - y, coords[:, 2] - z
+            return np.rint(np.sqrt(dx**2 + dy**2 + dz**2)).astype(np.int64)
+        return [int(round(sqrt((px - x)**2 + (py - y)**2 + (pz - z)**2), 0)) for px, py, pz in coords]
+
+    @staticmethod
+    def distance_matrix(positions1, positions2=None):
+        """
+        Returns the distances between all positions of positions1 and all positions of positions2 as a matrix
+        with one row per position of positions1. If positions2 is None the distances within positions1 are returned.
+        """
+        coords1 = ActorPosition._coords(positions1)
+        coords2 = ActorPosition._coords(positions2) if positions2 is not None else coords1
+        if np is not None:
+            dx, dy, dz = (coords1[:, c, np.newaxis] - coords2[np.newaxis, :, c] for c in range(3))
+            return np.rint(np.sqrt(dx**2 + dy**2 + dz**2)).astype(np.int64)
+        return [
+            [int(round(sqrt((x1 - x2)**2 + (y1 - y2)**2 + (z1 - z2)**2), 0)) for x2, y2, z2 in coords2]
+            for x1, y1, z1 in coords1
+        ]
+
+    @staticmethod
+    def pairs_within(positions1, radius, positions2=None):
+        """
+        Returns (i, j, distance) tuples for all pairs of positions1[i] and positions2[j] within radius of each other
+        sorted by i and j. If positions2 is None all pairs within positions1 with i < j are returned.
+        """
+        coords1 = ActorPosition._coords(positions1)
+        coords2 = ActorPosition._coords(positions2) if positions2 is not None else coords1
+        if np is not None:
+            coords1, coords2 = coords1.tolist(), coords2.tolist()
+        # only positions in neighbouring grid cells can be within radius of each other
+        grid = _Grid(radius) if radius > 0 else None
+        cells = dict()
+        for j, pos in enumerate(coords2):
+            if grid:
+                grid.add(j, pos)
+            else:
+                cells.setdefault(tuple(pos), []).append(j)
+        pairs = []
+        for i, (x, y, z) in enumerate(coords1):
+            candidates = grid.near((x, y, z)) if grid else cells.get((x, y, z), [])
+            for j in sorted(candidates):
+                if positions2 is None and j <= i:
+                    continue
+                x2, y2, z2 = coords2[j]
+                dist = sqrt((x - x2)**2 + (y - y2)**2 + (z - z2)**2)
+                if dist <= radius:
+                    pairs.append((i, j, int(round(dist, 0))))
+        return pairs
+
     @property
     def properties(self):
         return PropertiesList(self._properties)
@@ -1264,6 +2716,50 @@ class Buildings(GameBase):
         guild = session.query(Guilds).filter_by(id=self.owner_id).first()
         return guild
 
+    @staticmethod
+    def near(x, y, z=None, radius=5000):
+        """
+        Returns all buildings and placeables within radius of the given position sorted by their distance.
+        The distance is only measured in the x/y plane if z is None.
+        """
+        census = TileCensus.get()
+        grid = census.get_grid()
+        objects = []
+        for idx in grid.near((x, y), reach=ceil(radius / grid.cell_size)):
+            dist = census.distance(idx, x, y, z)
+            if dist <= radius:
+                objects.append({
+                    'object_id': census.object_ids[idx],
+                    'owner_id': census.owner_ids[idx],
+                    'distance': int(round(dist, 0))
+                })
+        return sorted(objects, key=itemgetter('distance'))
+
+    @staticmethod
+    def nearest_owners(x, y, k=5, z=None):
+        """
+        Returns the k owners closest to the given position together with their closest object sorted by distance.
+        The distance is only measured in the x/y plane if z is None.
+        """
+        census = TileCensus.get()
+        grid = census.get_grid()
+        # closest object of each owner found so far indexed by owner_id
+        nearest = dict()
+        for reach in range(grid.max_reach((x, y)) + 1):
+            for idx in grid.ring((x, y), reach):
+                dist = census.distance(idx, x, y, z)
+                owner_id = census.owner_ids[idx]
+                if owner_id not in nearest or dist < nearest[owner_id][0]:
+                    nearest[owner_id] = (dist, idx)
+            # objects in the next ring are at least reach cells away so if k owners are closer than that we're done
+            if len(nearest) >= k and sorted(d for d, _ in nearest.values())[k - 1] <= reach * grid.cell_size:
+                break
+        owners = [
+            {'owner_id': owner_id, 'object_id': census.object_ids[idx], 'distance': int(round(dist, 0))}
+            for owner_id, (dist, idx) in sorted(nearest.items(), key=lambda item: item[1][0])[:k]
+        ]
+        return owners
+
     @staticmethod
     def _verify_loc(loc):
         # no location info is correct in that it means no filter is applied
@@ -1281,7 +2777,7 @@ class Buildings(GameBase):
         return True
 
     @staticmethod
-    def _get_objects_query(owner_ids=None, loc=None, inverse=False, attach=None):
+    def _get_objects_query(owner_ids=None, loc=None, inverse=False, attach=None, spatial=None):
         # If owner_ids is empty and selection isn't inverted, no objects need to be copied
         if not owner_ids and owner_ids is not None and not inverse:
             return None
@@ -1296,6 +2792,9 @@ class Buildings(GameBase):
             query_list.append(f"FROM {attach}buildings")
         # Create the WHERE clause depending on loc, owner_id and inverse
         where_list = ["id = object_id"] if loc else []
+        # narrow down the actors within loc with the spatial index if one was attached
+        if loc and spatial and not inverse:
+            where_list.append(SpatialIndex.get_filter(loc, spatial))
         if loc and len(loc) == 2:
             x, y = loc
             if not inverse:
@@ -1400,8 +2899,12 @@ class Buildings(GameBase):
             print("loc:", loc)
             return None
 
+        # use the spatial index of the source db for location filters if it's up to date
+        index = SpatialIndex(source_db)
+        spatial = 'spatial' if loc and not inverse and index.is_current else None
+
         # generate the apropriate query with the information given
-        obj_ids = Buildings._get_objects_query(owner_ids, loc, inverse, attach='src')
+        obj_ids = Buildings._get_objects_query(owner_ids, loc, inverse, attach='src', spatial=spatial)
 
         # if obj_ids is empty, we're done here.
         if not obj_ids:
@@ -1428,6 +2931,8 @@ class Buildings(GameBase):
         source_db_path = SAVED_DIR_PATH + '/' + source_db
         with engine.begin() as conn:
             conn.execute(f"ATTACH DATABASE '{source_db_path}' AS 'src'")
+            if spatial:
+                conn.execute(f"ATTACH DATABASE '{index.path}' AS '{spatial}'")
             # Delete conflicting objects in the destination db if they exist
             conn.execute(f"DELETE FROM buildable_health {wobi} ({obj_ids}) {oo} {thrall_ids}")
             conn.execute(f"DELETE FROM building_instances {wobi} ({obj_ids}) {oo} {thrall_ids}")
@@ -1472,11 +2977,17 @@ class Buildings(GameBase):
             print("loc:", loc)
             return None
 
+        # use the spatial index of the db for location filters if it's up to date
+        index = SpatialIndex(db)
+        spatial = 'spatial' if loc and not inverse and index.is_current else None
+
         # generate the apropriate query with the information given
-        obj_ids = Buildings._get_objects_query(owner_ids, loc, inverse)
+        obj_ids = Buildings._get_objects_query(owner_ids, loc, inverse, spatial=spatial)
 
         # do the actual deleting
         with engine.begin() as conn:
+            if spatial:
+                conn.execute(f"ATTACH DATABASE '{index.path}' AS '{spatial}'")
             obj_ids_tt = "SELECT object_id FROM obj_ids"
             conn.execute(f"CREATE TEMPORARY TABLE obj_ids AS {obj_ids}")
             conn.execute(f"DELETE FROM buildable_health WHERE object_id IN ({obj_ids_tt})")
@@ -1502,7 +3013,16 @@ class Buildings(GameBase):
             return None
 
         filter = Buildings._get_objects_filter(owner_ids=old_owner_id, loc=loc)
-        if loc is not None:
+        # narrow down the actors within loc with the spatial index if it's up to date
+        index = SpatialIndex(GAME_DB)
+        if loc is not None and index.is_current:
+            ids = index.query(loc)
+            for idx in range(0, len(ids), CHUNK_SIZE):
+                chunk_filter = filter & ActorPosition.id.in_(ids[idx:idx + CHUNK_SIZE])
+                obj_ids = session.query(Buildings.object_id).filter(chunk_filter).scalar_subquery()
+                session.query(Buildings).filter(Buildings.object_id.in_(obj_ids)) \
+                    .update({Buildings.owner_id: new_owner_id}, synchronize_session='fetch')
+        elif loc is not None:
             obj_ids = session.query(Buildings.object_id).filter(filter).scalar_subquery()
             session.query(Buildings).filter(Buildings.object_id.in_(obj_ids)) \
                 .update({Buildings.owner_id: new_owner_id}, synchronize_session='fetch')
@@ -1810,6 +3330,71 @@ class Characters(GameBase, Owner):
         if autocommit:
             session.commit()
 
+    @staticmethod
+    def purge(character_ids, whitelist=[], chunk_size=CHUNK_SIZE):
+        """
+        Set based version of remove for large numbers of characters. Guilds whose members are all removed and accounts
+        left without characters are determined with grouped queries over temporary tables on a dedicated connection.
+        Rows are then deleted in transactions of up to chunk_size ids each, so the game.db isn't locked for the whole
+        purge. Changes to the game.db pending in the session should be committed before.
+        Returns a dict with the number of deleted rows per table.
+        """
+        if not isinstance(character_ids, ITER):
+            character_ids = (character_ids,)
+        whitelist = set(whitelist)
+        char_ids = [id for id in character_ids if id not in whitelist]
+        # format: (table, id column) of all tables with rows belonging to the removed characters
+        tables = (
+            (ActorPosition.__table__, ActorPosition.id),
+            (CharacterStats.__table__, CharacterStats.char_id),
+            (ItemInventory.__table__, ItemInventory.owner_id),
+            (ItemProperties.__table__, ItemProperties.owner_id),
+            (Properties.__table__, Properties.object_id),
+            (Purgescores.__table__, Purgescores.purge_id),
+            (Characters.__table__, Characters.id),
+        )
+        counts = {table.name: 0 for table, _ in tables}
+        counts.update({Guilds.__tablename__: 0, Account.__tablename__: 0})
+        if not char_ids:
+            return counts
+
+        with engines["gamedb"].connect() as conn:
+            conn.execute("CREATE TEMPORARY TABLE IF NOT EXISTS purge_chars (id INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM temp.purge_chars")
+            conn.execute("INSERT OR IGNORE INTO temp.purge_chars (id) VALUES (?)", [(id,) for id in char_ids])
+            # guilds that have members and all of them are going to be removed
+            guild_ids = [id for id, in conn.execute(
+                "SELECT guild FROM characters WHERE guild IS NOT NULL GROUP BY guild "
+                "HAVING SUM(id NOT IN (SELECT id FROM temp.purge_chars)) = 0"
+            ).all() if id not in whitelist]
+            # accounts whose characters, i.e. playerId and all alts with playerId#n, are all going to be removed
+            pure_player_id = (
+                "CASE WHEN length(playerId) > 2 AND substr(playerId, -2, 1) = '#' "
+                "THEN substr(playerId, 1, length(playerId) - 2) ELSE playerId END"
+            )
+            player_ids = [id for id, in conn.execute(
+                f"SELECT {pure_player_id} AS pure_id FROM characters WHERE playerId IS NOT NULL GROUP BY pure_id "
+                f"HAVING SUM(id NOT IN (SELECT id FROM temp.purge_chars)) = 0"
+            ).all()]
+            conn.execute("DROP TABLE temp.purge_chars")
+
+            for idx in range(0, len(char_ids), chunk_size):
+                chunk = char_ids[idx:idx + chunk_size]
+                with conn.begin():
+                    for table, column in tables:
+                        counts[table.name] += conn.execute(table.delete().where(column.in_(chunk))).rowcount
+            for ids, table, column in (
+                (guild_ids, Guilds.__table__, Guilds.id),
+                (player_ids, Account.__table__, Account.player_id)
+            ):
+                for idx in range(0, len(ids), chunk_size):
+                    with conn.begin():
+                        chunk = ids[idx:idx + chunk_size]
+                        counts[table.name] += conn.execute(table.delete().where(column.in_(chunk))).rowcount
+        # objects of deleted rows might still be in the identity map
+        session.expire_all()
+        return counts
+
     @staticmethod
     def move_to_guild(character_id, guild_id, autocommit=True):
         char = session.query(Characters).get(character_id)
@@ -1827,10 +3412,13 @@ class Characters(GameBase, Owner):
             ts = floor(date.timestamp())
         if not isinstance(character_ids, ITER):
             character_ids = (character_ids,)
-        for character_id in character_ids:
-            char = session.query(Characters).get(character_id)
-            if char and ts:
-                char.last_login = ts
+        character_ids = list(character_ids)
+        if ts:
+            # one UPDATE per chunk instead of loading each character, evaluate also updates the chars already loaded
+            for idx in range(0, len(character_ids), CHUNK_SIZE):
+                chunk = character_ids[idx:idx + CHUNK_SIZE]
+                session.query(Characters).filter(Characters.id.in_(chunk)) \
+                       .update({Characters._last_login: ts}, synchronize_session='evaluate')
         if autocommit:
             session.commit()
 
@@ -2045,6 +3633,68 @@ class Properties(GameBase):
         silver, bronze = divmod(remainder, 100)
         return (gold, silver, bronze)
 
+    @staticmethod
+    def _decode_money(value):
+        """
+        Will convert the blob of a Pippi wallet into a bronze value
+        """
+        # Pippi stores 4 byte little endian ints, same as WALLET_FORMAT used by decode_wallets
+        gold, silver, bronze = (unpack_from('<i', value, offset)[0] for offset in WALLET_OFFSETS)
+        return Properties.tuple2bronze((gold, silver, bronze))
+
+    @staticmethod
+    def decode_wallets(rows):
+        """
+        Will convert many (object_id, value) rows of Pippi wallets into bronze values at once.
+        Returns two arrays of equal length with the object_ids and their bronze values.
+        Rows whose value is too short to hold a wallet are left out.
+        """
+        object_ids, blobs = [], []
+        for object_id, value in rows:
+            if value is not None and len(value) >= WALLET_SIZE:
+                object_ids.append(object_id)
+                blobs.append(value[:WALLET_SIZE])
+        # all wallets are stored back to back so gold, silver and bronze are each found every WALLET_SIZE bytes
+        buffer = b''.join(blobs)
+        if np is not None:
+            def column(offset):
+                return np.ndarray((len(blobs),), '<i4', buffer, offset, (WALLET_SIZE,)).astype(np.int64)
+
+            if not blobs:
+                return np.array(object_ids, dtype=np.int64), np.array([], dtype=np.int64)
+            gold, silver, bronze = (column(offset) for offset in WALLET_OFFSETS)
+            return np.array(object_ids, dtype=np.int64), (gold * 100 + silver) * 100 + bronze
+        amounts = array('q', (Properties.tuple2bronze(tpl) for tpl in iter_unpack(WALLET_FORMAT, buffer)))
+        return array('q', object_ids), amounts
+
+    @staticmethod
+    def encode_wallets(values, amounts):
+        """
+        Will write many bronze values into their respective Pippi wallet blobs at once.
+        Returns a list with the updated blobs in the same order as the values given.
+        """
+        if len(values) != len(amounts):
+            raise ValueError("Number of wallets and amounts must match.")
+        if any(amount < 0 or amount > 21474836479999 for amount in amounts):
+            raise ValueError("Pippi can only store bronze values between 0 and 21.474.836.479.999.")
+        if any(value is None or len(value) < WALLET_SIZE for value in values):
+            raise ValueError("Not all values are Pippi wallets.")
+        buffer = bytearray(b''.join(value[:WALLET_SIZE] for value in values))
+        if np is not None and values:
+            amounts = np.asarray(amounts, dtype=np.int64)
+            gold, remainder = np.divmod(amounts, 10000)
+            silver, bronze = np.divmod(remainder, 100)
+            for offset, column in zip(WALLET_OFFSETS, (gold, silver, bronze)):
+                np.ndarray((len(values),), '<i4', buffer, offset, (WALLET_SIZE,))[:] = column
+        else:
+            for idx, amount in enumerate(amounts):
+                for offset, coin in zip(WALLET_OFFSETS, Properties.bronze2tuple(amount)):
+                    pack_into('<i', buffer, idx * WALLET_SIZE + offset, coin)
+        return [
+            bytes(buffer[idx * WALLET_SIZE:(idx + 1) * WALLET_SIZE]) + value[WALLET_SIZE:]
+            for idx, value in enumerate(values)
+        ]
+
     @staticmethod
     def get_thrall_object_ids(name=None, owner_id=None, strict=False):
         objects = []
@@ -2223,13 +3873,39 @@ class Properties(GameBase):
             return None
         if not isinstance(object_ids, ITER):
             object_ids = (object_ids,)
-        for object_id in object_ids:
-            filter = (Properties.object_id == object_id) & (Properties.name.like('%OwnerUniqueId'))
-            p = session.query(Properties).filter(filter).first()
-            o = Owner.exists(owner_id)
-            if not (p and o):
+        object_ids = list(object_ids)
+        if object_ids:
+            if not Owner.exists(owner_id):
                 return None
-            p.owner_id = owner_id
+            P = Properties
+            rows = []
+            for idx in range(0, len(object_ids), CHUNK_SIZE):
+                chunk = object_ids[idx:idx + CHUNK_SIZE]
+                rows += session.query(P.object_id, P.name, P.value) \
+                               .filter(P.object_id.in_(chunk), P.name.like('%OwnerUniqueId')).all()
+            # only the first matching property of each object (ordered by name like the primary key) is changed
+            owner_props = dict()
+            for object_id, name, value in sorted(rows, key=itemgetter(0, 1)):
+                owner_props.setdefault(object_id, (name, value))
+            # nothing is changed unless all objects are thralls
+            if len(owner_props) < len(set(object_ids)):
+                return None
+            # same as setting Properties.owner_id for each property
+            new_owner = pack("<q", owner_id)
+            params = [
+                {'b_object_id': object_id, 'b_name': name, 'new_value': value[:-8] + new_owner}
+                for object_id, (name, value) in owner_props.items() if "OwnerUniqueID" in name
+            ]
+            if params:
+                table = P.__table__
+                filter = (table.c.object_id == bindparam('b_object_id')) & (table.c.name == bindparam('b_name'))
+                stmt = table.update().where(filter).values(value=bindparam('new_value'))
+                session.execute(stmt, params, bind_arguments={'mapper': P.__mapper__})
+                # properties already loaded into the session need to be reloaded to reflect the new values
+                for param in params:
+                    p = session.identity_map.get(session.identity_key(P, (param['b_object_id'], param['b_name'])))
+                    if p:
+                        session.expire(p, ['value'])
         if autocommit:
             session.commit()
 
@@ -2271,11 +3947,7 @@ class Properties(GameBase):
     def money(self):
         if not self.name == "Pippi_WalletComponent_C.walletAmount":
             return None
-
-        gold = unpack('@l', self.value[73:77])[0]
-        silver = unpack('@l', self.value[148:152])[0]
-        bronze = unpack('@l', self.value[223:227])[0]
-        return Properties.tuple2bronze((gold, silver, bronze))
+        return Properties._decode_money(self.value)
 
     async def set_money(self, value):
         """
@@ -2298,9 +3970,6 @@ class Properties(GameBase):
         if value < 0 or value > 21474836479999:
             raise ValueError("Pippi can only store bronze values between 0 and 21.474.836.479.999.")
 
-        # this is the gold, silver and bronze that is supposed to be set
-        gold, silver, bronze = Properties.bronze2tuple(value)
-
         # calculate the difference between the original and the future money balance
         diff_num = value - self.money
         if diff_num > 0:
@@ -2312,21 +3981,22 @@ class Properties(GameBase):
             return
 
         # convert and add the gold, silver and bronze values into the blob that is used in the sql method
-        money = (
-            self.value[:73] + pack("@l", gold) +
-            self.value[77:148] + pack("@l", silver) +
-            self.value[152:223] + pack("@l", bronze) +
-            self.value[227:]
-        )
+        # using the same 4 byte little endian ints that money and decode_wallets read
+        money = Properties.encode_wallets([self.value], [value])[0]
 
         # if the server is running a decision needs to be made between the Pippi rcon and the sql method
-        if is_running():
+        if server_state.is_running():
             # we start with the assumption that the char is online and Pippi can find them
             char_not_found = False
             # keep the result of the allows_login check for later use
-            _allows_login = allows_login()
+            _allows_login = server_state.allows_login()
+            # only the active character of an account can be online, which only matters if logging in is possible
+            online = (
+                _allows_login and char.slot == "active" and
+                bool(presence.is_online(char.id) if presence else char.account.online)
+            )
             # if mcr is available, logging in is possible and char is online, try the Pippi method
-            if trc and _allows_login and char.slot == "active" and char.account.online:
+            if trc and _allows_login and online:
 
                 async def set_with_rcon(change, name, amount):
                     """ Tries to use rcon to add or remove the given amount of money to the given char. """
@@ -2353,13 +4023,13 @@ class Properties(GameBase):
                 elif result not in success_msg:
                     raise ValueError(result)
             # if all signs point towards the character being online but no mcr is available, raise an exception
-            elif (not trc or not trc.is_connected) and _allows_login and char.slot == "active" and char.account.online:
+            elif (not trc or not trc.is_connected) and _allows_login and online:
                 raise ValueError("Cannot assign Pippi money while character is online  without RCon connection.")
 
             # if char is not online it should be safe to set the money directly via sql
             if (
                 char_not_found or char.slot != "active" or not _allows_login or
-                (_allows_login and char.slot == "active" and not char.account.online)
+                (_allows_login and char.slot == "active" and not online)
             ):
                 self.value = money
 
@@ -0,0 +1,130 @@
+"""
+Parsing of single Chat.log, Commands.log and ConanSandbox.log lines and files used by ChatLogs.
+The module itself has no database or config imports but importing it as exiles_api.logparse runs the package
+__init__ first. Worker processes started by spawning (e.g. on Windows) therefore import the whole package, including
+config.py and the db engines, once when they start, which is why ChatLogs keeps its worker processes between calls.
+"""
+import gzip
+from datetime import datetime
+
+# use the fastest JSON decoder available, all of them raise a ValueError on malformed lines
+try:
+    from orjson import loads
+except ImportError:
+    try:
+        from ujson import loads
+    except ImportError:
+        from json import loads
+
+# zstandard is only needed to read and write .log.zst files
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSED_EXTENSIONS = ('.gz', '.zst')
+
+
+def open_log(filename, mode='rt'):
+    """
+    Opens a log file that may have been compressed when it was rotated, i.e. ends with .log.gz or .log.zst.
+    Text mode decodes utf-8 and strips the byte order mark written by the game.
+    """
+    encoding = 'utf-8-sig' if 't' in mode else None
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode, encoding=encoding)
+    if filename.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f"zstandard is required to read {filename}")
+        return zstandard.open(filename, mode, encoding=encoding)
+    return open(filename, mode, encoding=encoding)
+
+
+def parse_date(value):
+    """
+    Returns the datetime of a timestamp in the fixed width format YYYY.MM.DD-HH.MM.SS:mmm or None if it isn't one.
+    Same as datetime.strptime(value, '%Y.%m.%d-%H.%M.%S:%f') for timestamps of that width but slices the fields
+    instead of matching a format.
+    """
+    try:
+        if len(value) != 23 or value[4] != '.' or value[10] != '-' or value[19] != ':':
+            return None
+        return datetime(
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19]), int(value[20:23]) * 1000
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_line(name, line):
+    """
+    Returns the record of a single line of the given log or None if the line isn't a chat or command record.
+    Raises an exception if a line of the JSON style logs can't be parsed.
+    """
+    # Old style ConanSandbox.log parsing
+    if name == 'ConanSandbox':
+        """
+        Example Chat (ConanSandbox.log)
+        [2000.01.01-12.00.00:000][Pippi]PippiChat: Alice said in channel [Alice:Bob]: Hello Bob!
+                                                   ^div_1                          ^div_2
+        """
+        if not line.startswith('[') or '[Pippi]PippiChat: ' not in line:
+            return None
+        date = parse_date(line[1:24])
+        if not date:
+            return None
+        data = {'datetime': date}
+        div_1 = 43
+        div_2 = line.find(']:', div_1)
+        data['name'], channel = line[div_1:div_2].split(" said in channel [")
+        if channel in ('Global', 'Local', 'Emote', 'Shout', 'Mumble') or ':' in channel:
+            data['channel'] = channel
+        else:
+            data['channel'] = 'Guild'
+        data['type'] = 'Chat'
+        data['content'] = line[div_2+3:-1]
+        if '"' in data['content']:
+            data['content'] = data['content'].replace('"', "'")
+        for c in ';\n\r':
+            if c in data['content']:
+                data['content'] = data['content'].replace(c, '')
+        return data
+
+    # New JSON style Chat.log parsing
+    data = loads(line)
+    value = data.get('datetime')
+    data['datetime'] = parse_date(value) if isinstance(value, str) else None
+    return data if data['datetime'] else None
+
+
+def iter_file(name, filename, after_date=None, offset=0):
+    """
+    Lazily yields the records of a single log file dated after after_date without its first and last line.
+    If offset is given reading starts at that byte which has to be the start of a line of the uncompressed file.
+    """
+    with open_log(filename) as f:
+        lines = iter(f)
+        # the first line is only skipped if reading starts at the top of the file
+        if offset:
+            f.seek(offset)
+        else:
+            next(lines, None)
+        line = next(lines, None)
+        # a line is only parsed once the following one has been read, so the last line is never parsed
+        for line_number, next_line in enumerate(lines, start=1 if offset else 2):
+            try:
+                data = parse_line(name, line)
+            except Exception:
+                # line numbers are relative to the offset if reading didn't start at the top of the file
+                position = f"{filename}:{line_number}" if not offset else f"{filename}@{offset}+{line_number}"
+                print(f"Failed loading JSON from {position}")
+                data = None
+            if data and (not after_date or data['datetime'] > after_date):
+                yield data
+            line = next_line
+
+
+def parse_file(name, filename, after_date=None, offset=0):
+    """Returns all records of iter_file as a list. Used as the task of worker processes."""
+    return list(iter_file(name, filename, after_date, offset))
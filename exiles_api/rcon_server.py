@@ -0,0 +1,132 @@
+"""
+Local stand-in for the RCon server of the game speaking the Source RCON protocol for testing and benchmarking clients.
+Replies are scripted by adding handlers for command prefixes. A handler is either the reply itself or a function
+taking the command and returning the reply or an awaitable of it. Replies can be delayed with slow() and a reply of
+DISCONNECT closes the connection instead of replying.
+Run it standalone with: python -m exiles_api.rcon_server --port 25575 --password secret --online Alice Bob
+"""
+import re
+import asyncio
+import argparse
+from struct import pack, unpack
+
+LOGIN = 3
+COMMAND = 2
+AUTH_RESPONSE = 2
+RESPONSE = 0
+
+# returned by a handler to close the connection without replying
+DISCONNECT = object()
+
+
+def slow(seconds, reply):
+    """Returns a handler that waits seconds before replying with reply."""
+    async def handler(cmd):
+        await asyncio.sleep(seconds)
+        return reply(cmd) if callable(reply) else reply
+    return handler
+
+
+class RConServer:
+    """
+    RCon server replying like the game server to Currency and ListPlayers commands for the characters in online
+    and with an empty reply to any other command that has no handler. The port is picked by the os if it's 0.
+    """
+    def __init__(self, host='127.0.0.1', port=0, password='', online=None):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.online = list(online or [])
+        self.handlers = [('Currency ', self._currency), ('ListPlayers', self._list_players)]
+        self.num_connections = 0
+        self.num_commands = 0
+        self._server = None
+        self._writers = set()
+
+    def add_handler(self, prefix, handler):
+        """Replies to all commands starting with prefix using handler. Handlers added later take precedence."""
+        self.handlers.insert(0, (prefix, handler))
+
+    def _currency(self, cmd):
+        match = re.match(r'Currency (add|remove) "(.*)" (\d+) bronze', cmd)
+        if not match:
+            return ''
+        change, name, amount = match.group(1), match.group(2), int(match.group(3))
+        if name not in self.online:
+            return f"No players found with the name '{name}'"
+        if change == 'add':
+            return f"You gave {name} {amount:,} Bronze"
+        return f"You removed {amount:,} Bronze from {name}"
+
+    def _list_players(self, cmd):
+        lines = ["Idx | Char name | Player name | User ID | Platform ID | Platform Name"]
+        for idx, name in enumerate(self.online):
+            lines.append(f"{idx:3d} | {name} | Player{idx} | {idx:016X} | {idx:017d} | Steam")
+        return '\n'.join(lines) + '\n'
+
+    async def _reply(self, cmd):
+        for prefix, handler in self.handlers:
+            if cmd.startswith(prefix):
+                reply = handler(cmd) if callable(handler) else handler
+                if asyncio.iscoroutine(reply):
+                    reply = await reply
+                return reply
+        return ''
+
+    @staticmethod
+    def _packet(req_id, type_, body):
+        data = pack('<ii', req_id, type_) + body.encode('utf8') + b'\x00\x00'
+        return pack('<i', len(data)) + data
+
+    async def _handle(self, reader, writer):
+        self.num_connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                size, = unpack('<i', await reader.readexactly(4))
+                data = await reader.readexactly(size)
+                req_id, type_ = unpack('<ii', data[:8])
+                body = data[8:-2].decode('utf8', errors='replace')
+                if type_ == LOGIN:
+                    # a failed login is answered with the request id -1
+                    writer.write(self._packet(req_id if body == self.password else -1, AUTH_RESPONSE, ''))
+                else:
+                    self.num_commands += 1
+                    reply = await self._reply(body)
+                    if reply is DISCONNECT:
+                        break
+                    writer.write(self._packet(req_id, RESPONSE, reply))
+                await writer.drain()
+        # connections still open when the server is stopped are cancelled
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self):
+        await self.start()
+        await self._server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the RCon server of the game.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=25575)
+    parser.add_argument('--password', default='')
+    parser.add_argument('--online', nargs='*', default=[], help="names of the characters that are online")
+    args = parser.parse_args()
+    asyncio.run(RConServer(args.host, args.port, args.password, args.online).serve_forever())
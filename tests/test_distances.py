@@ -0,0 +1,89 @@
+"""
+Compares the batched distance methods of ActorPosition with distance_to and distance_between, once using NumPy and
+once with the pure Python fallback. Needs to be run from a directory containing a config.py like the benchmarks.
+"""
+import random
+from math import sqrt
+from types import SimpleNamespace
+import pytest
+import exiles_api
+from exiles_api import ActorPosition
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@pytest.fixture(params=['numpy', 'python'], autouse=True)
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        if numpy is None:
+            pytest.skip("NumPy is not installed")
+        monkeypatch.setattr(exiles_api, 'np', numpy)
+    else:
+        monkeypatch.setattr(exiles_api, 'np', None)
+    return request.param
+
+
+def to_list(result):
+    return result.tolist() if hasattr(result, 'tolist') else result
+
+
+def make_positions(num, seed, spread=20000):
+    rand = random.Random(seed)
+    positions = [
+        SimpleNamespace(x=rand.uniform(-spread, spread), y=rand.uniform(-spread, spread), z=rand.uniform(-500, 500))
+        for _ in range(num)
+    ]
+    # duplicates, integer coordinates and distances ending in .5 that have to be rounded half to even
+    positions += [SimpleNamespace(x=0, y=0, z=0), SimpleNamespace(x=0, y=0, z=0), SimpleNamespace(x=2.5, y=0, z=0)]
+    positions += [SimpleNamespace(x=3.5, y=0, z=0), SimpleNamespace(x=100, y=200, z=-300)]
+    return positions
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_distances_to(seed):
+    positions = make_positions(200, seed)
+    for pos in positions[-5:] + positions[:5]:
+        expected = [ActorPosition.distance_to(other, pos) for other in positions]
+        assert to_list(ActorPosition.distances_to(positions, pos)) == expected
+
+
+def test_distances_to_accepts_coordinates():
+    positions = make_positions(50, 3)
+    coords = [(p.x, p.y, p.z) for p in positions]
+    pos = positions[0]
+    expected = [ActorPosition.distance_between(other, pos) for other in positions]
+    assert to_list(ActorPosition.distances_to(coords, (pos.x, pos.y, pos.z))) == expected
+    if exiles_api.np is not None:
+        assert to_list(ActorPosition.distances_to(exiles_api.np.array(coords), pos)) == expected
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_distance_matrix(seed):
+    positions1, positions2 = make_positions(60, seed), make_positions(40, seed + 100)
+    expected = [[ActorPosition.distance_between(p1, p2) for p2 in positions2] for p1 in positions1]
+    assert to_list(ActorPosition.distance_matrix(positions1, positions2)) == expected
+    expected = [[ActorPosition.distance_between(p1, p2) for p2 in positions1] for p1 in positions1]
+    assert to_list(ActorPosition.distance_matrix(positions1)) == expected
+
+
+def brute_force_pairs(positions1, radius, positions2=None):
+    pairs = []
+    for i, p1 in enumerate(positions1):
+        for j, p2 in enumerate(positions2 if positions2 is not None else positions1):
+            if positions2 is None and j <= i:
+                continue
+            if sqrt((p1.x - p2.x)**2 + (p1.y - p2.y)**2 + (p1.z - p2.z)**2) <= radius:
+                pairs.append((i, j, ActorPosition.distance_between(p1, p2)))
+    return pairs
+
+
+@pytest.mark.parametrize('radius', [0, 3, 1000, 5000, 50000])
+@pytest.mark.parametrize('seed', range(3))
+def test_pairs_within(seed, radius):
+    positions1, positions2 = make_positions(150, seed), make_positions(100, seed + 100)
+    assert ActorPosition.pairs_within(positions1, radius) == brute_force_pairs(positions1, radius)
+    expected = brute_force_pairs(positions1, radius, positions2)
+    assert ActorPosition.pairs_within(positions1, radius, positions2) == expected